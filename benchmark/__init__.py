@@ -0,0 +1,3 @@
+'''Benchmarks of fuseq with synthetic data
+
+Run "python -m benchmark --help" in the repository root directory.'''
@@ -0,0 +1,23 @@
+import argparse
+from benchmark.runner import Runner
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmark',
+                                     description='Run fuseq for synthetic data of several sizes',
+                                     epilog='Other options are passed to fuseq')
+    parser.add_argument('out_dir', type=str, help='Directory for synthetic data and results')
+    parser.add_argument('--sizes', default='100,1000', type=str, help='Comma-separated numbers of fusion lines per sample')
+    parser.add_argument('--samples', default=2, type=int, help='Number of samples')
+    parser.add_argument('--max-reads', default=8, type=int, help='Maximum number of supporting reads per fusion line')
+    parser.add_argument('--seed', default=1, type=int, help='Seed for random data')
+    # Unknown options are passed to fuseq
+    args, fuseq_args = parser.parse_known_args()
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    fuseq_args = [arg for arg in fuseq_args if arg != '--']
+    Runner(args.out_dir, sizes, args.samples, args.max_reads, args.seed, fuseq_args).run()
+
+
+if __name__ == '__main__':
+    main()
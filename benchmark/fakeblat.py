@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+'''Deterministic stand-in for blat
+
+Usage: fakeblat.py [options] database query output
+
+Each query is aligned without gaps on the plus strand by extending exact
+matches of k-mers in the database, and the alignments are written in psl
+format. Options of blat are accepted and ignored, except that -makeOoc
+writes an empty ooc file and -noHead omits the psl header.'''
+
+import sys
+
+K = 16
+HEADER = '''psLayout version 3
+
+match\tmis- \trep. \tN's\tQ gap\tQ gap\tT gap\tT gap\tstrand\tQ        \tQ   \tQ    \tQ  \tT        \tT   \tT    \tT  \tblock\tblockSizes \tqStarts\t tStarts
+     \tmatch\tmatch\t   \tcount\tbases\tcount\tbases\t      \tname     \tsize\tstart\tend\tname     \tsize\tstart\tend\tcount
+---------------------------------------------------------------------------------------------------------------------------------------------------------------
+'''
+
+
+def read_fasta(path):
+    seqs = {}
+    name = None
+    with open(path, 'r') as f:
+        for row in f:
+            row = row.rstrip('\n')
+            if row.startswith('>'):
+                name = row[1:].split()[0]
+                seqs[name] = []
+            elif name is not None:
+                seqs[name].append(row.upper())
+    return {name: ''.join(rows) for name, rows in seqs.items()}
+
+
+def align(name, query, ref, index):
+    rows = []
+    i = 0
+    while i + K <= len(query):
+        hit = index.get(query[i:i + K])
+        if hit is None:
+            i += 1
+            continue
+        chr, t = hit
+        target = ref[chr]
+        n = K
+        while i + n < len(query) and t + n < len(target) and query[i + n] == target[t + n]:
+            n += 1
+        rows.append(f'{n}\t0\t0\t0\t0\t0\t0\t0\t+\t{name}\t{len(query)}\t{i}\t{i + n}\t'
+                    f'{chr}\t{len(target)}\t{t}\t{t + n}\t1\t{n},\t{i},\t{t},\n')
+        i += n
+    return rows
+
+
+def main():
+    opts = [a for a in sys.argv[1:] if a.startswith('-')]
+    args = [a for a in sys.argv[1:] if not a.startswith('-')]
+    for opt in opts:
+        if opt.startswith('-makeOoc='):
+            open(opt.split('=', 1)[1], 'w').close()
+            return
+    if len(args) != 3:
+        print(__doc__)
+        sys.exit(1)
+    db_path, query_path, out_path = args
+
+    ref = read_fasta(db_path)
+    index = {}
+    for chr, seq in ref.items():
+        for t in range(len(seq) - K + 1):
+            index.setdefault(seq[t:t + K], (chr, t))
+
+    with open(out_path, 'w') as f:
+        if '-noHead' not in opts:
+            f.write(HEADER)
+        for name, query in read_fasta(query_path).items():
+            f.writelines(align(name, query, ref, index))
+
+
+if __name__ == '__main__':
+    main()
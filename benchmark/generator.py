@@ -0,0 +1,99 @@
+import os
+import random
+
+
+class Generator:
+    '''Synthetic reference and Genomon output directory'''
+
+    chrs = ['1', '2', '3', '4', '5', 'X']
+    read_len = 100
+    header = 'Sample\tChr_1\tPos_1\tDir_1\tChr_2\tPos_2\tDir_2\tInserted\tGene_1\tJunc_1\tGene_2\tJunc_2\n'
+
+    def __init__(self, out_dir, n_samples=2, n_lines=100, max_reads=8, chr_len=200000, seed=1):
+        self.out_dir = out_dir
+        self.n_samples = n_samples
+        self.n_lines = n_lines
+        self.max_reads = max_reads
+        self.chr_len = chr_len
+        self.rnd = random.Random(seed)
+        self.reference = f'{out_dir}/reference.fa'
+        self.genomon_root_dir = f'{out_dir}/genomon'
+        self.__ref = {}
+
+    def __random_seq(self, n):
+        return ''.join(self.rnd.choice('ACGT') for _ in range(n))
+
+    def __create_reference(self):
+        self.__ref = {chr: self.__random_seq(self.chr_len) for chr in self.chrs}
+        with open(self.reference, 'w') as f:
+            for chr, seq in self.__ref.items():
+                f.write(f'>{chr}\n')
+                for i in range(0, len(seq), 60):
+                    f.write(seq[i:i + 60] + '\n')
+
+    def __create_sample(self, sample):
+        rnd = self.rnd
+        ref = self.__ref
+        mf_dir = f'{self.genomon_root_dir}/post_analysis/{sample}'
+        star_dir = f'{self.genomon_root_dir}/star/{sample}'
+        os.makedirs(mf_dir, exist_ok=True)
+        os.makedirs(star_dir, exist_ok=True)
+
+        lines = []
+        juns = []
+        sams = []
+        margin = self.read_len
+        for i in range(self.n_lines):
+            chr1, chr2 = rnd.choice(self.chrs), rnd.choice(self.chrs)
+            bp1, bp2 = rnd.randint(margin, self.chr_len - margin), rnd.randint(margin, self.chr_len - margin)
+            strand1, strand2 = rnd.choice('+-'), rnd.choice('+-')
+            lines.append(f'{sample}\t{chr1}\t{bp1}\t{strand1}\t{chr2}\t{bp2}\t{strand2}\t---\t'
+                         f'GENE{i}A\texon-intron\tGENE{i}B\texon-intron\n')
+            jun1 = bp1 + 1 if strand1 == '+' else bp1 - 1
+            jun2 = bp2 + 1 if strand2 == '+' else bp2 - 1
+            for j in range(rnd.randint(0, self.max_reads)):
+                readname = f'{sample}:{i}:{j}'
+                # Either orientation is written in a junction file
+                if rnd.random() < 0.5:
+                    juns.append((chr1, jun1, strand1, chr2, jun2, strand2, readname))
+                else:
+                    juns.append((chr2, jun2, strand2, chr1, jun1, strand1, readname))
+                len1 = rnd.randint(30, self.read_len - 30)
+                len2 = self.read_len - len1
+                seq = ref[chr1][bp1 - len1:bp1] + ref[chr2][bp2 - 1:bp2 - 1 + len2]
+                qual = 'I' * self.read_len
+                sams.append(f'{readname}\t0\t{chr1}\t{bp1 - len1 + 1}\t255\t{len1}M{len2}S\t{chr2}\t{bp2}\t0\t'
+                            f'{seq}\t{qual}\tNH:i:1\tHI:i:1\tAS:i:98\tnM:i:0')
+                # Supplementary alignment that fuseq skips
+                sams.append(f'{readname}\t2048\t{chr2}\t{bp2}\t255\t{len1}H{len2}M\t=\t{bp1}\t0\t'
+                            f'{seq[len1:]}\t{qual[len1:]}\tNH:i:1\tHI:i:1\tAS:i:98\tnM:i:0')
+
+        # Unrelated reads
+        for j in range(2 * self.n_lines):
+            readname = f'{sample}:noise:{j}'
+            chr1, chr2 = rnd.choice(self.chrs), rnd.choice(self.chrs)
+            pos1, pos2 = rnd.randint(1, self.chr_len), rnd.randint(1, self.chr_len)
+            juns.append((chr1, pos1, '+', chr2, pos2, '-', readname))
+            sams.append(f'{readname}\t0\t{chr1}\t{pos1}\t255\t{self.read_len}M\t{chr2}\t{pos2}\t0\t'
+                        f'{self.__random_seq(self.read_len)}\t{"I" * self.read_len}\tNH:i:1\tHI:i:1\tAS:i:98\tnM:i:0')
+
+        rnd.shuffle(juns)
+        rnd.shuffle(sams)
+        with open(f'{mf_dir}/merge_fusionfusion_filt.txt', 'w') as f:
+            f.write(self.header)
+            f.writelines(lines)
+        prefix = f'{star_dir}/{sample}.Chimeric.out'
+        with open(f'{prefix}.junction', 'w') as f:
+            for chr1, pos1, strand1, chr2, pos2, strand2, readname in juns:
+                f.write(f'{chr1}\t{pos1}\t{strand1}\t{chr2}\t{pos2}\t{strand2}\t1\t0\t0\t{readname}\t'
+                        f'1\t50M50S\t1\t50S50M\n')
+        with open(f'{prefix}.sam', 'w') as f:
+            f.write('@HD\tVN:1.4\n')
+            for sam in sams:
+                f.write(f'{sam}\n')
+
+    def run(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.__create_reference()
+        for i in range(self.n_samples):
+            self.__create_sample(f'SAMPLE{i + 1}')
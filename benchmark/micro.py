@@ -0,0 +1,217 @@
+'''Micro-benchmarks of the per-read functions of BlatFilter
+
+Usage: python -m benchmark.micro [--save] [--baseline PATH] [--max-slowdown RATIO]
+
+Collect and psl fixtures are generated in memory with a fixed seed, and each
+case is timed with timeit to take the fastest time of one call. With --save the times
+are stored as a baseline, otherwise they are compared with the baseline and
+the exit status is 1 if a case is slower than the baseline by more than the
+given ratio. Baselines depend on the machine, so save them on the machine
+that compares.'''
+
+import argparse
+import io
+import json
+import os
+import random
+import tempfile
+import timeit
+from types import SimpleNamespace
+from fuseq.blat_filter import BlatFilter
+from fuseq.breakinfo import BreakInfo
+
+
+class Fixture:
+    '''Break information, collect file and psl file of random reads'''
+
+    chrs = ['1', '2', '3', '4', '5', 'X']
+    read_len = 100
+    chr_len = 10000000
+
+    def __init__(self, n_lines, max_reads, seed):
+        rnd = random.Random(seed)
+        self.breakinfo = []
+        self.coll_rows = []
+        self.psl_rows = []
+        for linenr in range(2, n_lines + 2):
+            chr1, chr2 = rnd.choice(self.chrs), rnd.choice(self.chrs)
+            bp1, bp2 = rnd.randint(1000, self.chr_len), rnd.randint(1000, self.chr_len)
+            cnt = rnd.randint(1, max_reads)
+            self.breakinfo.append(BreakInfo(linenr, 'SAMPLE', chr1, str(bp1), '+', f'GENE{linenr}A', 'exon-intron',
+                                            chr2, str(bp2), '-', f'GENE{linenr}B', 'exon-intron', cnt))
+            for j in range(cnt):
+                readname = f'{linenr}-{j + 1}_READ:{linenr}:{j}'
+                seq = ''.join(rnd.choice('ACGT') for _ in range(self.read_len))
+                self.coll_rows.append(f'>{readname}\n{seq}\n')
+                self.psl_rows.extend(self.__psl_rows(rnd, readname, chr1, bp1, chr2, bp2))
+
+    def __psl_rows(self, rnd, readname, chr1, bp1, chr2, bp2):
+        len1 = rnd.randint(30, self.read_len - 30)
+        aligns = []
+        kind = rnd.random()
+        if kind < 0.9:
+            aligns.append((0, len1, chr1, bp1 - len1))
+        if kind > 0.1:
+            aligns.append((len1, self.read_len, chr2, bp2 - 1))
+        # Shorter alignments with the same start position
+        for qs, qe, chr, ts in list(aligns):
+            if rnd.random() < 0.5:
+                aligns.append((qs, qe - rnd.randint(1, 10), chr, ts))
+        # Alignments elsewhere in the genome
+        for _ in range(rnd.randint(0, 4)):
+            qs = rnd.randint(0, self.read_len - 20)
+            aligns.append((qs, qs + 20, rnd.choice(self.chrs), rnd.randint(0, self.chr_len)))
+        rows = []
+        for qs, qe, chr, ts in sorted(aligns):
+            te = ts + qe - qs + (1 if rnd.random() < 0.05 else 0)  # A gap in few alignments
+            rows.append(f'{qe - qs}\t0\t0\t0\t0\t0\t0\t0\t+\t{readname}\t{self.read_len}\t{qs}\t{qe}\t'
+                        f'{chr}\t{self.chr_len}\t{ts}\t{te}\t1\t{qe - qs},\t{qs},\t{ts},\n')
+        return rows
+
+
+class Micro:
+    '''Time the hot functions of BlatFilter for a fixture'''
+
+    def __init__(self, fixture, repeat):
+        self.fixture = fixture
+        self.repeat = repeat
+        params = SimpleNamespace(bp_start_extn=0, bp_end_extn=0, check_pos_intvl=True, print_filt_err=False)
+        self.bf = BlatFilter(params, fixture.breakinfo)
+        self.reads = self.__parse()
+
+    def __parse(self):
+        '''Inputs of the per-read functions in the same way as the filter'''
+        linenr2d = {d.linenr: d for d in self.fixture.breakinfo}
+        reads = {}
+        for row in self.fixture.psl_rows:
+            s = row.rstrip('\n').split('\t')
+            readname = s[9]
+            d = linenr2d[int(readname[:readname.index('-')])]
+            pos_start, pos_end, bp_start, bp_end = int(s[11]), int(s[12]), int(s[15]), int(s[16])
+            poses = reads.setdefault(readname, (d, []))[1]
+            if pos_end - pos_start != bp_end - bp_start:
+                continue
+            if s[13] == d.chr1 and bp_start + 1 <= int(d.bp1) <= bp_end:
+                poses.append((pos_start + 1, pos_end, 1, bp_start + 1, bp_end, s[13], s[8]))
+            elif s[13] == d.chr2 and bp_start + 1 <= int(d.bp2) <= bp_end:
+                poses.append((pos_start + 1, pos_end, 2, bp_start + 1, bp_end, s[13], s[8]))
+        seq = 'A' * Fixture.read_len
+        return [(d, readname, seq, poses) for readname, (d, poses) in reads.items()]
+
+    def __time(self, func):
+        '''Fastest time of one call with garbage collection disabled as timeit does'''
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        return min(timer.repeat(self.repeat, number)) / number
+
+    @staticmethod
+    def __fws():
+        return {key: io.StringIO() for key in ('filtmatch', 'filtmiss', 'filterr', 'filtwar')}
+
+    def __pos_filter(self):
+        pos_filter = self.bf._BlatFilter__pos_filter
+        for _, _, _, poses in self.reads:
+            pos_filter(poses)
+
+    def __check_pos(self):
+        check_pos = self.bf._BlatFilter__check_pos
+        fws = self.__fws()
+        for d, readname, seq, poses, poses_filt in self.filtered:
+            check_pos(poses_filt, fws, d, readname, seq, poses, [])
+
+    def __pos_sort(self):
+        pos_sort = self.bf._BlatFilter__pos_sort
+        for d, _, _, _, poses_filt in self.checked:
+            pos_sort(poses_filt, d)
+
+    def __write_to_file(self):
+        write_to_file = self.bf._BlatFilter__write_to_file
+        fws = self.__fws()
+        for d, readname, seq, _, poses_filt in self.sorted:
+            write_to_file(fws, d, readname, seq, poses_filt, [])
+
+    def run(self):
+        bf = self.bf
+        self.filtered = [(d, rn, seq, poses, bf._BlatFilter__pos_filter(list(poses)))
+                         for d, rn, seq, poses in self.reads]
+        fws = self.__fws()
+        self.checked = [(d, rn, seq, poses, bf._BlatFilter__check_pos(pf, fws, d, rn, seq, poses, []))
+                        for d, rn, seq, poses, pf in self.filtered]
+        self.sorted = []
+        for d, rn, seq, poses, pf in self.checked:
+            pf, d = bf._BlatFilter__pos_sort(pf, d)
+            self.sorted.append((d, rn, seq, poses, pf))
+
+        results = {'pos_filter': self.__time(self.__pos_filter),
+                   'check_pos': self.__time(self.__check_pos),
+                   'pos_sort': self.__time(self.__pos_sort),
+                   'write_to_file': self.__time(self.__write_to_file)}
+        # Whole filter including psl parsing
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            coll_path = f'{tmp_dir}/collect.txt'
+            blat_path = f'{tmp_dir}/blat.psl'
+            with open(coll_path, 'w') as f:
+                f.writelines(self.fixture.coll_rows)
+            with open(blat_path, 'w') as f:
+                f.writelines(self.fixture.psl_rows)
+            out_paths = {key: f'{tmp_dir}/{key}' for key in ('filtmatch', 'filtmiss', 'filterr', 'filtwar')}
+            results['filter'] = self.__time(lambda: bf._BlatFilter__filter(coll_path, blat_path, out_paths))
+        return results
+
+
+def compare(results, baseline, max_slowdown):
+    '''Print the times with their ratios to the baseline and return False if a case regresses'''
+    ok = True
+    print(f'{"case":>14} {"time[s]":>10} {"baseline[s]":>12} {"ratio":>7}')
+    for case, t in results.items():
+        base = baseline.get(case)
+        if base:
+            ratio = t / base
+            status = '' if ratio <= max_slowdown else '  <- slower'
+            ok = ok and ratio <= max_slowdown
+            print(f'{case:>14} {t:>10.4f} {base:>12.4f} {ratio:>7.2f}{status}')
+        else:
+            print(f'{case:>14} {t:>10.4f} {"-":>12} {"-":>7}')
+    return ok
+
+
+def main():
+    default_baseline = f'{os.path.dirname(os.path.abspath(__file__))}/micro_baseline.json'
+    parser = argparse.ArgumentParser(prog='python -m benchmark.micro',
+                                     description='Micro-benchmarks of the per-read functions of BlatFilter')
+    parser.add_argument('--lines', default=2000, type=int, help='Number of fusion lines of a fixture')
+    parser.add_argument('--max-reads', default=8, type=int, help='Maximum number of reads per fusion line')
+    parser.add_argument('--seed', default=1, type=int, help='Seed for a fixture')
+    parser.add_argument('--repeat', default=5, type=int, help='Number of timings of each case to take the fastest one')
+    parser.add_argument('--baseline', default=default_baseline, type=str, help='Path to a baseline file')
+    parser.add_argument('--max-slowdown', default=1.5, type=float, help='Maximum ratio of a time to its baseline')
+    parser.add_argument('--save', action='store_true', help='Save the times as the baseline')
+    args = parser.parse_args()
+
+    fixture = Fixture(args.lines, args.max_reads, args.seed)
+    results = Micro(fixture, args.repeat).run()
+    fixture_args = {'lines': args.lines, 'max_reads': args.max_reads, 'seed': args.seed}
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump({'fixture': fixture_args, 'results': results}, f, indent=2)
+        compare(results, {}, args.max_slowdown)
+        print(f'[Info] Baseline is written to {args.baseline}')
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f'[Error] Baseline does not exist: {args.baseline}')
+        print('Run with --save to create it')
+        exit(1)
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    if baseline['fixture'] != fixture_args:
+        print(f'[Error] Fixture differs from the baseline: {baseline["fixture"]}')
+        exit(1)
+    if not compare(results, baseline['results'], args.max_slowdown):
+        print(f'[Error] Slower than the baseline by more than {args.max_slowdown}x')
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from benchmark.generator import Generator
+
+
+class Runner:
+    '''Run fuseq for synthetic data of several sizes and summarize metrics'''
+
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    fuseq_path = f'{root_dir}/fuseq.py'
+    fakeblat_path = f'{root_dir}/benchmark/fakeblat.py'
+    stages = ['collection', 'blat', 'filter']
+
+    def __init__(self, out_dir, sizes, n_samples=2, max_reads=8, seed=1, fuseq_args=None):
+        self.out_dir = os.path.abspath(out_dir)
+        self.sizes = sizes
+        self.n_samples = n_samples
+        self.max_reads = max_reads
+        self.seed = seed
+        self.fuseq_args = fuseq_args if fuseq_args else []
+
+    def __generate(self, size):
+        data_dir = f'{self.out_dir}/data/{size}'
+        generator = Generator(data_dir, self.n_samples, size, self.max_reads, seed=self.seed)
+        if not os.path.isfile(f'{data_dir}/.done'):
+            shutil.rmtree(data_dir, ignore_errors=True)
+            generator.run()
+            open(f'{data_dir}/.done', 'w').close()
+        return generator
+
+    def __read_metrics(self, fuseq_root_dir):
+        result = {'stages': {stage: 0.0 for stage in self.stages}, 'counts': {}}
+        for path in sorted(glob.glob(f'{fuseq_root_dir}/**/metrics.json', recursive=True)):
+            with open(path, 'r') as f:
+                metrics = json.load(f)
+            for stage, values in metrics['stages'].items():
+                result['stages'][stage] = result['stages'].get(stage, 0.0) + values['wall']
+            for key, n in metrics['counts'].items():
+                result['counts'][key] = result['counts'].get(key, 0) + n
+        return result
+
+    def __run_fuseq(self, size, generator):
+        fuseq_root_dir = f'{self.out_dir}/fuseq/{size}'
+        shutil.rmtree(fuseq_root_dir, ignore_errors=True)
+        cmd = [sys.executable, self.fuseq_path, generator.genomon_root_dir, fuseq_root_dir,
+               '--reference', generator.reference, '--blat-path', self.fakeblat_path] + self.fuseq_args
+        start = time.time()
+        p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        wall = time.time() - start
+        if p.returncode != 0:
+            print(p.stdout.decode())
+            print(f'[Error] fuseq failed for size {size}')
+            exit(1)
+        result = self.__read_metrics(fuseq_root_dir)
+        result['size'] = size
+        result['wall'] = wall
+        return result
+
+    def __print(self, results):
+        stages = [stage for stage in results[0]['stages'].keys()]
+        columns = ['size', 'reads', 'psl_rows'] + stages + ['total']
+        print(' '.join(f'{c:>12}' for c in columns))
+        for r in results:
+            values = [r['size'], r['counts'].get('reads', 0), r['counts'].get('psl_rows', 0)]
+            values += [f'{r["stages"][stage]:.3f}' for stage in stages] + [f'{r["wall"]:.3f}']
+            print(' '.join(f'{v:>12}' for v in values))
+
+    def run(self):
+        results = []
+        for size in self.sizes:
+            generator = self.__generate(size)
+            results.append(self.__run_fuseq(size, generator))
+        self.__print(results)
+        path = f'{self.out_dir}/benchmark.json'
+        with open(path, 'w') as f:
+            json.dump({'fuseq_args': self.fuseq_args, 'n_samples': self.n_samples,
+                       'max_reads': self.max_reads, 'seed': self.seed, 'results': results}, f, indent=2)
+        print(f'[Info] Results are written to {path}')
+        return results
@@ -1,33 +1,81 @@
 #!/usr/bin/env python3
 
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from fuseq.command import Command
 from fuseq.option import Option
 from fuseq.genomon import Genomon
 from fuseq.pipeline import Pipeline
+from fuseq.metrics import Metrics
+from fuseq.batch import Batch
+from fuseq.refcache import RefCache
+
+
+def create_params(opt, genomon, mf_dir, mf_path):
+    params = opt.copy()
+
+    # Paths
+    work_dir = f'{params.fuseq_root_dir}/{mf_dir}/{params.work_dirname}'
+    swork_dir = f'{params.fuseq_root_dir}/{mf_dir}/{params.work_dirname}/{params.swork_dirname}'
+    fuseq_path = f'{params.fuseq_root_dir}/{mf_dir}/{params.fuseq_filename}'
+    inputs = {'mf_path': mf_path, 'star_dir': genomon.star_dir}
+
+    # Add to params
+    params.work_dir = work_dir
+    params.swork_dir = swork_dir
+    params.fuseq_path = fuseq_path
+    params.inputs = inputs
+    params.metrics = Metrics(mf_dir)
+
+    return params
+
+
+def run(opt, genomon, mf_dir, mf_path):
+    pipeline = Pipeline(create_params(opt, genomon, mf_dir, mf_path))
+    pipeline.run()
+
+
+def run_batch(opt, genomon):
+    params = opt.copy()
+    params.work_dir = f'{params.fuseq_root_dir}/{params.work_dirname}'
+    params.swork_dir = f'{params.fuseq_root_dir}/{params.work_dirname}/{params.swork_dirname}'
+    params.metrics = Metrics('batch')
+    pipelines = [Pipeline(create_params(opt, genomon, mf_dir, mf_path))
+                 for mf_dir, mf_path in genomon.mf_dic.items()]
+    Batch(params, pipelines).run()
 
 
 def main():
 
+    # Commands are killed on interruption since they do not receive signals from the terminal
+    signal.signal(signal.SIGINT, Command.interrupt)
+    signal.signal(signal.SIGTERM, Command.interrupt)
+
     opt = Option()
     genomon = Genomon(opt.refer())
 
-    for mf_dir, mf_path in genomon.mf_dic.items():
-        params = opt.copy()
+    # Reference files for blat are prepared once for all samples
+    args = opt.refer()
+    if args.ref_cache and not args.stop_blat and not args.restart_filter:
+        args.ref_twobit, args.ooc = RefCache(args).prepare()
 
-        # Paths
-        work_dir = f'{params.fuseq_root_dir}/{mf_dir}/{params.work_dirname}'
-        swork_dir = f'{params.fuseq_root_dir}/{mf_dir}/{params.work_dirname}/{params.swork_dirname}'
-        fuseq_path = f'{params.fuseq_root_dir}/{mf_dir}/{params.fuseq_filename}'
-        inputs = {'mf_path': mf_path, 'star_dir': genomon.star_dir}
+    # Blat runs only once for all samples
+    if args.batch_samples and not args.is_restart and not args.stop_blat:
+        run_batch(opt, genomon)
+        return
 
-        # Add to params
-        params.work_dir = work_dir
-        params.swork_dir = swork_dir
-        params.fuseq_path = fuseq_path
-        params.inputs = inputs
+    n_parallels = args.num_sample_parallels
+    if n_parallels == 1:
+        for mf_dir, mf_path in genomon.mf_dic.items():
+            run(opt, genomon, mf_dir, mf_path)
+        return
 
-        # Run
-        pipeline = Pipeline(params)
-        pipeline.run()
+    # Samples share the processes given by the budget in options
+    with ThreadPoolExecutor(n_parallels) as executor:
+        futures = [executor.submit(run, opt, genomon, mf_dir, mf_path)
+                   for mf_dir, mf_path in genomon.mf_dic.items()]
+    for future in futures:
+        future.result()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,49 @@
+from fuseq.base import Base
+from fuseq.blat import Blat, PBlat
+from fuseq.blat_cache import BlatCache
+from fuseq.dedup import Dedup
+from fuseq.gfserver import GfServer
+from fuseq.reference import MiniReference
+
+
+class Alignment(Base):
+    '''Blat of a collect file with the options for the reference and unique sequences'''
+
+    def __init__(self, params, breakinfo, files=None, on_shard=None):
+        super().__init__(files)
+        self.params = params
+        self.breakinfo = breakinfo
+        self.on_shard = on_shard
+
+    def run(self):
+        reference = None
+        if self.params.gfserver:
+            reference = GfServer(self.params).start()
+        if self.params.ref_window:
+            mini_ref = MiniReference(self.params, self.breakinfo)
+            reference = mini_ref.create()
+        blat_files = self.files
+        n_seqs = None
+        if self.params.dedup:
+            blat_cache = BlatCache(self.params, reference or self.params.reference) if self.params.blat_cache else None
+            dedup = Dedup(self.params, blat_cache, self.files)
+            n_seqs = dedup.compress()
+            blat_files = {'coll': self.files['coll_uniq'], 'blat': self.files['blat_uniq']}
+        on_shard = self.on_shard
+        if self.on_shard and self.params.ref_window:
+            def on_shard(i, coll_path, blat_path):
+                mini_ref.lift(blat_path)
+                self.on_shard(i, coll_path, blat_path)
+        if n_seqs == 0:
+            # All sequences are in the blat cache
+            open(f'{self.params.work_dir}/{blat_files["blat"]}', 'w').close()
+        elif self.params.on_shirokane or self.params.num_blat_parallels > 1:
+            PBlat(self.params, reference, blat_files, on_shard).run()
+        else:
+            Blat(self.params, reference, blat_files).run()
+        if self.params.ref_window and not self.on_shard:
+            mini_ref.lift(f'{self.params.work_dir}/{blat_files["blat"]}')
+        if self.params.dedup:
+            dedup.expand()
+            if blat_cache:
+                blat_cache.close()
@@ -1,30 +1,68 @@
+import hashlib
 import os
 import re
-import subprocess
 import time
+from fuseq.command import Command
 
 class Base:
-    def __init__(self):
+    def __init__(self, files=None):
         self.files = {'params': 'parameters', 'breakinfo': 'break_information',
-                      'coll': 'collect', 'blat': 'blat',
+                      'coll': 'collect', 'blat': 'blat', 'miniref': 'mini_reference.fa',
+                      'coll_uniq': 'collect_unique', 'blat_uniq': 'blat_unique',
                       'filtmatch': 'filter_match', 'filtmiss': 'filter_miss',
                       'filtwar': 'filter_warning', 'filterr': 'filter_error',
-                      'coll_res': 'collect_restart', 'blat_res': 'blat_restart'}
+                      'coll_res': 'collect_restart', 'blat_res': 'blat_restart',
+                      'store': 'intermediate.db', 'coll_cache': 'collection_cache.db'}
+        # Replace file names
+        if files:
+            self.files.update(files)
 
-    def _run_cmd(self, cmd, name=None, ignore_err=False):
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-        out, err = p.communicate()
-        out = out.decode().rstrip('\n')
-        err = err.decode().rstrip('\n')
+    def __add_cmd_metrics(self, name, wall, returncode):
+        metrics = getattr(getattr(self, 'params', None), 'metrics', None)
+        if metrics:
+            metrics.add_cmd(name, wall, returncode)
+
+    def __command(self, timeout=None):
+        if timeout is None:
+            timeout = getattr(getattr(self, 'params', None), 'cmd_timeout', 0)
+        return Command(timeout)
+
+    def __check_ret(self, ret, name, ignore_err):
+        out, err, returncode = ret
         if ignore_err:
-            return out, err, p.returncode
-        if p.returncode != 0:
+            return ret
+        if returncode != 0:
             if not name:
                 print(f'[Error] at {name} runtime')
             print(err)
             exit(1)
         return out
 
+    def _run_cmd(self, cmd, name=None, ignore_err=False, on_line=None, command=None, timeout=None):
+        '''Run a shell command with asyncio, passing stdout to on_line if given'''
+        command = command if command else self.__command(timeout)
+        start = time.time()
+        ret = command.run(cmd, on_line)
+        self.__add_cmd_metrics(name, time.time() - start, ret[2])
+        return self.__check_ret(ret, name, ignore_err)
+
+    def _run_cmds(self, cmds, name=None, ignore_err=False, num_parallels=None):
+        '''Run independent shell commands at the same time and return their results in order'''
+        start = time.time()
+        rets = self.__command().run_all(cmds, num_parallels or len(cmds))
+        wall = time.time() - start  # Time of all commands
+        for ret in rets:
+            self.__add_cmd_metrics(name, wall, ret[2])
+        return [self.__check_ret(ret, name, ignore_err) for ret in rets]
+
+    def _hash_file(self, path, block_size=1 << 24):
+        '''Return the sha1 digest of the content of a file'''
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for blk in iter(lambda: f.read(block_size), b''):
+                h.update(blk)
+        return h.hexdigest()
+
     # Array job
     def _run_cmd_on_uge(self, cmd, path, num_parallels, name=None):
         '''Execute array job and wait for completion
@@ -35,8 +73,19 @@ class Base:
         os.chmod(path, 0o0755)
 
         cmd = f'qsub -terse -sync y -t 1-{num_parallels}:1 {path}'
-        out, err, ret = self._run_cmd(cmd, 'qsub', ignore_err=True)
-        # out contains jobid and return codes
+        # Return codes are taken from the output of qsub as each task finishes
+        lines = []
+        ret_codes = []
+
+        def on_line(line):
+            match = re.match(r'^Job (.*) exited with exit code ([\d]+)\.$', line.rstrip('\n'))
+            if match:
+                ret_codes.append((match.group(1), match.group(2)))
+            else:
+                lines.append(line)
+
+        _, err, ret = self._run_cmd(cmd, name, ignore_err=True, on_line=on_line, timeout=0)  # Time of the whole array job
+        out = ''.join(lines).rstrip('\n')  # out contains jobid
 
         if err:
             print('[stderr]')
@@ -46,17 +95,12 @@ class Base:
             exit(1)
 
         # Obtain return codes from qsub
-        num_matched = 0
+        num_matched = len(ret_codes)
         is_okay = True
-        for o in out.split('\n')[1:]:
-            match = re.match(r'^Job (.*) exited with exit code ([\d]+)\.$', o)
-            if match:
-                num_matched += 1
-                jobid = match.group(1)
-                ret_code = match.group(2)
-                if ret_code != '0':
-                    print(f'[Error] {jobid} failed with exit code {ret_code}')
-                    is_okay = False
+        for jobid, ret_code in ret_codes:
+            if ret_code != '0':
+                print(f'[Error] {jobid} failed with exit code {ret_code}')
+                is_okay = False
         if not is_okay:
             if num_matched != num_parallels:
                 print('[Error] Cannot get all exit codes')
@@ -69,7 +113,7 @@ class Base:
             time.sleep(10)
             for _ in range(20):
                 cmd = f'qacct -j {jobid} | grep exit_status'
-                out, _, ret = self._run_cmd(cmd, 'qacct', ignore_err=True)
+                out, _, ret = self._run_cmd(cmd, 'qacct', ignore_err=True, timeout=0)
                 if ret == 0:
                     break
                 else:
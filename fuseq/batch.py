@@ -0,0 +1,78 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from fuseq.base import Base
+from fuseq.alignment import Alignment
+from fuseq.timer import Timer
+
+
+class Batch(Base):
+    '''Blat for all samples at once on one collect file with the reads tagged by sample'''
+
+    sep = ':'
+
+    def __init__(self, params, pipelines):
+        super().__init__()
+        self.params = params
+        self.pipelines = pipelines
+        self.coll_path = f'{params.work_dir}/{self.files["coll"]}'
+        self.blat_path = f'{params.work_dir}/{self.files["blat"]}'
+
+    def __map(self, func, args):
+        '''Call func for each sample with the given number of samples at the same time'''
+        n_parallels = self.params.num_sample_parallels
+        if n_parallels == 1:
+            return [func(*arg) for arg in args]
+        with ThreadPoolExecutor(n_parallels) as executor:
+            futures = [executor.submit(func, *arg) for arg in args]
+        return [future.result() for future in futures]
+
+    def __create_work_dir(self):
+        shutil.rmtree(self.params.work_dir, ignore_errors=True)
+        os.makedirs(self.params.swork_dir)
+
+    def __concat(self):
+        with open(self.coll_path, 'w') as fw:
+            for i, pipeline in enumerate(self.pipelines):
+                with open(f'{pipeline.params.work_dir}/{self.files["coll"]}', 'r') as fr:
+                    for row in fr:
+                        if row.startswith('>'):
+                            row = f'>{i}{self.sep}{row[1:]}'
+                        fw.write(row)
+
+    def __demultiplex(self):
+        fws = [open(f'{pipeline.params.work_dir}/{self.files["blat"]}', 'w') for pipeline in self.pipelines]
+        with open(self.blat_path, 'r') as fr:
+            for row in fr:
+                sp = row.split('\t')
+                i, sp[9] = sp[9].split(self.sep, 1)  # qname
+                fws[int(i)].write('\t'.join(sp))
+        for fw in fws:
+            fw.close()
+
+    def __blat(self, breakinfos):
+        Alignment(self.params, [d for breakinfo in breakinfos for d in breakinfo]).run()
+
+    @Timer('batch_blat')
+    def __run_blat(self, breakinfos):
+        self.__create_work_dir()
+        self.__concat()
+        self.__blat(breakinfos)
+        self.__demultiplex()
+
+    def run(self):
+        # Collection for each sample
+        breakinfos = self.__map(lambda pipeline: pipeline.collect(), [(p,) for p in self.pipelines])
+
+        # Blat for all samples
+        self.__run_blat(breakinfos)
+        if self.params.delete_work:
+            shutil.rmtree(self.params.work_dir, ignore_errors=True)
+
+        if not self.params.stop_filter:
+            # Filter for each sample
+            self.__map(lambda pipeline, breakinfo: pipeline.filter(breakinfo), zip(self.pipelines, breakinfos))
+
+        self.params.metrics.save(self.params.work_dir)
+        for pipeline in self.pipelines:
+            pipeline.save_metrics()
@@ -1,10 +1,34 @@
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from fuseq.timer import Timer
 from fuseq.base import Base
+from fuseq.command import Command
+
+
+def _aligner(params, reference):
+    '''Return an aligner command without input and output files and its memory usage'''
+    if params.gfserver:
+        # The reference is held in memory by gfServer
+        seq_dir = os.path.dirname(reference)
+        return f'{params.gfclient_path} {params.blat_opts} -nohead ' \
+               f'{params.gfserver_host} {params.gfserver_port} {seq_dir}', 0
+    ooc = ''
+    if params.ooc:
+        # Prepared by RefCache
+        ooc = f' -ooc={params.ooc}'
+        if reference == params.reference:
+            reference = params.ref_twobit
+    # Blat loads the whole reference into memory
+    return f'{params.blat_path} {params.blat_opts}{ooc} -noHead {reference}', os.path.getsize(reference)
+
 
 class Blat(Base):
-    def __init__(self, params):
-        super().__init__()
+    def __init__(self, params, reference=None, files=None):
+        super().__init__(files)
         self.params = params
+        self.reference = reference if reference else params.reference
 
     @Timer('blat')
     def run(self):
@@ -12,23 +36,28 @@ class Blat(Base):
 #!/bin/bash
 set -eu
 cd {work_dir}
-{blat_path} {blat_opts} -noHead {reference} {inp_file} {out_file}
-'''.format(work_dir=self.params.work_dir, blat_path=self.params.blat_path,
-           blat_opts=self.params.blat_opts, reference=self.params.reference,
-           inp_file=self.files['coll'], out_file=self.files['blat'])
-        self._run_cmd(cmd, 'blat')
+{aligner} {inp_file} {out_file}
+'''
+        aligner, mem = _aligner(self.params, self.reference)
+        cmd = cmd.format(work_dir=self.params.work_dir, aligner=aligner,
+                         inp_file=self.files['coll'], out_file=self.files['blat'])
+        with self.params.budget.use(1, mem):
+            self._run_cmd(cmd, 'blat')
 
 
 #
-# Parallelization of Blat on Shirokane
+# Parallelization of Blat on Shirokane or the local host
 #
 
 class PBlat(Base):
-    def __init__(self, params):
-        super().__init__()
+    def __init__(self, params, reference=None, files=None, on_shard=None):
+        super().__init__(files)
         self.params = params
+        self.reference = reference if reference else params.reference
+        self.on_shard = on_shard  # Called with the index and paths of input and output of each finished shard
+        self.command = Command(params.cmd_timeout)  # Blat of all shards is cancelled when a shard fails
         self.num_coll_lines = self.__calculate_coll_lines()
-        max_parallels = int(self.num_coll_lines / 2)
+        max_parallels = max(int(self.num_coll_lines / 2), 1)
         self.num_parallels = \
             self.params.num_blat_parallels if self.params.num_blat_parallels < max_parallels \
             else max_parallels
@@ -64,15 +93,57 @@ echo -n $n_lines
 #!/bin/bash
 set -eu
 cd {swork_dir}
-head -{n_lines1} ../{inp_file} | split -a {width} -d -l {lines1} --numeric-suffixes=1 - {prefix}
-tail -{n_lines0} ../{inp_file} | split -a {width} -d -l {lines0} --numeric-suffixes={numr_sfx} - {prefix}
-'''.format(swork_dir=self.params.swork_dir, n_lines1=n_lines1,
-           inp_file=self.files['coll'], width=self.num_numeric_suffixes,
-           lines1=n_lines1_per_file, prefix=prefix, n_lines0=n_lines0,
-           lines0=n_lines0_per_file, numr_sfx=n_files1 + 1)
-        self._run_cmd(cmd, 'split_coll')
-
-    def __blat(self):
+{part} ../{inp_file} | split -a {width} -d -l {lines} --numeric-suffixes={numr_sfx} - {prefix}
+'''
+        # The head and the tail of the input are split at the same time
+        cmds = [cmd.format(swork_dir=self.params.swork_dir, part=f'head -{n_lines1}',
+                           inp_file=self.files['coll'], width=self.num_numeric_suffixes,
+                           lines=n_lines1_per_file, numr_sfx=1, prefix=prefix),
+                cmd.format(swork_dir=self.params.swork_dir, part=f'tail -{n_lines0}',
+                           inp_file=self.files['coll'], width=self.num_numeric_suffixes,
+                           lines=n_lines0_per_file, numr_sfx=n_files1 + 1, prefix=prefix)]
+        self._run_cmds(cmds, 'split_coll')
+
+    def __blat_shard(self, id):
+        cmd = '''\
+#!/bin/bash
+set -eu
+cd {swork_dir}
+{aligner} {inp_file}{id} {out_file}{id}
+'''
+        aligner, mem = _aligner(self.params, self.reference)
+        cmd = cmd.format(swork_dir=self.params.swork_dir, id=id, aligner=aligner,
+                         inp_file=self.files['coll'], out_file=self.files['blat'])
+        with self.params.budget.use(1, mem):
+            ret = self._run_cmd(cmd, 'blat', ignore_err=True, command=self.command)
+        if ret[2] == 0:
+            self.__call_on_shard(id)
+        else:
+            self.command.cancel()
+        return ret
+
+    def __call_on_shard(self, id):
+        if self.on_shard:
+            self.on_shard(int(id), f'{self.params.swork_dir}/{self.files["coll"]}{id}',
+                          f'{self.params.swork_dir}/{self.files["blat"]}{id}')
+
+    def __blat_on_local(self):
+        ids = [str(i).zfill(self.num_numeric_suffixes) for i in range(1, self.num_parallels + 1)]
+        with ThreadPoolExecutor(self.num_parallels) as executor:
+            futures = [executor.submit(self.__blat_shard, id) for id in ids]
+
+        # Check return codes
+        has_err = False
+        for id, future in zip(ids, futures):
+            _, err, rc = future.result()
+            if rc != 0:
+                print(f'[Error] Return code is not 0 at blat for {self.files["coll"]}{id}')
+                print(f'err: {err}, rc: {rc}')
+                has_err = True
+        if has_err:
+            exit(1)
+
+    def __blat_on_uge(self):
         cmd = '''\
 #!/usr/local/bin/nosh
 #$ -S /usr/local/bin/nosh
@@ -83,13 +154,14 @@ tail -{n_lines0} ../{inp_file} | split -a {width} -d -l {lines0} --numeric-suffi
 set -eu
 id=$(printf "%0{width}d" ${{SGE_TASK_ID}})
 cd {swork_dir}
-{blat_path} {blat_opts} -noHead {reference} {inp_file}${{id}} {out_file}${{id}}
+{aligner} {inp_file}${{id}} {out_file}${{id}}
 '''.format(swork_dir=self.params.swork_dir, out_file=self.files['blat'],
            width=self.num_numeric_suffixes,
-           blat_path=self.params.blat_path, blat_opts=self.params.blat_opts,
-           reference=self.params.reference, inp_file=self.files['coll'])
+           aligner=_aligner(self.params, self.reference)[0], inp_file=self.files['coll'])
         path = f'{self.params.swork_dir}/{self.files["blat"]}.sh'
         self._run_cmd_on_uge(cmd, path, self.num_parallels, 'blat_uge')
+        for i in range(1, self.num_parallels + 1):
+            self.__call_on_shard(str(i).zfill(self.num_numeric_suffixes))
 
     def __concat(self):
         cmd = '''\
@@ -105,6 +177,80 @@ cat {inp_files} > ../{out_file}
 
     @Timer('blat')
     def run(self):
+        if self.num_coll_lines == 0:
+            # No reads are collected
+            open(f'{self.params.work_dir}/{self.files["blat"]}', 'w').close()
+            return
         self.__split()
-        self.__blat()
+        if self.params.on_shirokane:
+            self.__blat_on_uge()
+        else:
+            self.__blat_on_local()
         self.__concat()
+
+
+#
+# Blat for output chunks of collection during collection
+#
+
+class SBlat(Base):
+    def __init__(self, params, reference=None):
+        super().__init__()
+        self.params = params
+        self.reference = reference if reference else params.reference
+        self.__executor = ThreadPoolExecutor(params.num_blat_parallels)
+        # Collection waits when this number of chunks are waiting for or running blat
+        self.__slots = threading.BoundedSemaphore(2 * params.num_blat_parallels)
+        self.__lock = threading.Lock()
+        self.__chunks = {}
+        self.command = Command(params.cmd_timeout)  # Blat of all chunks is cancelled when a chunk fails
+
+    def __blat(self, inp_path, out_path):
+        try:
+            if os.path.getsize(inp_path) == 0:
+                open(out_path, 'w').close()
+                return '', '', 0
+            aligner, mem = _aligner(self.params, self.reference)
+            cmd = f'{aligner} {inp_path} {out_path}'
+            with self.params.budget.use(1, mem):
+                ret = self._run_cmd(cmd, 'blat', ignore_err=True, command=self.command)
+            if ret[2] != 0:
+                self.command.cancel()
+            return ret
+        finally:
+            self.__slots.release()
+
+    def submit(self, i, inp_path):
+        '''Start blat for a finished chunk of collection'''
+        out_path = f'{inp_path}.{self.files["blat"]}'
+        self.__slots.acquire()
+        future = self.__executor.submit(self.__blat, inp_path, out_path)
+        with self.__lock:
+            self.__chunks[i] = (inp_path, out_path, future)
+
+    @Timer('blat')
+    def run(self, on_shard=None):
+        '''Wait for blat of all chunks and concatenate the results in chunk order'''
+        # on_shard is called as for PBlat in the order in which blat for the chunks is finished
+        futures = {future: i for i, (_, _, future) in self.__chunks.items()}
+
+        # Check return codes
+        has_err = False
+        for future in as_completed(futures):
+            inp_path, out_path, _ = self.__chunks[futures[future]]
+            _, err, rc = future.result()
+            if rc != 0:
+                print(f'[Error] Return code is not 0 at blat for {inp_path}')
+                print(f'err: {err}, rc: {rc}')
+                has_err = True
+            elif on_shard:
+                on_shard(futures[future], inp_path, out_path)
+        self.__executor.shutdown(wait=True)
+        if has_err:
+            exit(1)
+
+        # Concatenate
+        with open(f'{self.params.work_dir}/{self.files["blat"]}', 'wb') as fw:
+            for i in sorted(self.__chunks.keys()):
+                with open(self.__chunks[i][1], 'rb') as fr:
+                    shutil.copyfileobj(fr, fw)
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import sqlite3
+import time
+from fuseq.base import Base
+from fuseq.digest import Digests
+
+
+class BlatCache(Base):
+    '''Psl rows of sequences kept across runs and samples'''
+
+    db_file = 'blat_cache.db'
+
+    def __init__(self, params, reference):
+        super().__init__()
+        self.params = params
+        self.max_size = params.blat_cache_size * 1024 ** 3
+        os.makedirs(params.blat_cache, exist_ok=True)
+        self.con = sqlite3.connect(f'{params.blat_cache}/{self.db_file}', timeout=600)
+        self.con.execute('PRAGMA synchronous = OFF')
+        with self.con:
+            self.con.execute('CREATE TABLE IF NOT EXISTS entries '
+                             '(key TEXT PRIMARY KEY, rows TEXT, size INTEGER, used REAL)')
+            self.con.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+        self.prefix = f'{self.__get_opts()}\t{Digests(self.con).get(reference)}\t'
+        self.__hits = []
+
+    def __get_opts(self):
+        '''Options changing blat results'''
+        opts = sorted(self.params.blat_opts.split())
+        if self.params.gfserver:
+            opts.append('gfClient')
+        if self.params.ooc:
+            opts.append('ooc')
+        return ' '.join(opts)
+
+    def __key(self, seq):
+        return hashlib.sha1(f'{self.prefix}{seq}'.encode()).hexdigest()
+
+    def get(self, seq):
+        '''Return psl rows split at the query name or None if the sequence is not cached'''
+        key = self.__key(seq)
+        row = self.con.execute('SELECT rows FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.__hits.append(key)
+        return [r.split('\t', 10) for r in row[0].splitlines(keepends=True)]
+
+    def __evict(self):
+        total = self.con.execute('SELECT SUM(size) FROM entries').fetchone()[0] or 0
+        if total <= self.max_size:
+            return
+        keys = []
+        for key, size in self.con.execute('SELECT key, size FROM entries ORDER BY used'):
+            keys.append((key,))
+            total -= size
+            if total <= self.max_size:
+                break
+        self.con.executemany('DELETE FROM entries WHERE key = ?', keys)
+
+    def update(self, seq2rows):
+        '''Store psl rows split at the query name for each sequence and remove old entries'''
+        now = time.time()
+        entries = []
+        for seq, rows in seq2rows.items():
+            rows = ''.join('\t'.join(sp[:9] + [''] + sp[10:]) for sp in rows)
+            entries.append((self.__key(seq), rows, len(rows), now))
+        with self.con:
+            self.con.executemany('UPDATE entries SET used = ? WHERE key = ?', [(now, key) for key in self.__hits])
+            self.con.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', entries)
+            self.__evict()
+        self.__hits = []
+
+    def close(self):
+        self.con.close()
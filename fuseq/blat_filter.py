@@ -1,29 +1,35 @@
+import multiprocessing
 import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 from fuseq.base import Base
+from fuseq.psl import Psl
 from fuseq.timer import Timer
 
 class BlatFilter(Base):
-    def __init__(self, params, breakinfo):
-        super().__init__()
+
+    def __init__(self, params, breakinfo, files=None):
+        super().__init__(files)
         self.params = params
         self.breakinfo = breakinfo
+        # The index of breakinfo is derived from the leading line number of readnames
+        self.linenr2idx = {d.linenr: i for i, d in enumerate(breakinfo)}
 
     def __update_chr_bp(self, i, d):
-        return d[i]['chr1'], d[i]['chr2'], int(d[i]['bp1']), int(d[i]['bp2'])
+        return d[i].chr1, d[i].chr2, int(d[i].bp1), int(d[i].bp2)
 
     def __write_to_file(self, fws, breakinfo, readname, seq, poses_filt, other_info):
-        chr1 = breakinfo['chr1']
-        bp1 = breakinfo['bp1']
-        strand1 = breakinfo['strand1']
-        gene1 = breakinfo['gene1']
-        junc1 = breakinfo['junc1']
-        chr2 = breakinfo['chr2']
-        bp2 = breakinfo['bp2']
-        gene2 = breakinfo['gene2']
-        junc2 = breakinfo['junc2']
-        strand2 = breakinfo['strand2']
-        mfline = breakinfo['linenr']
+        chr1 = breakinfo.chr1
+        bp1 = breakinfo.bp1
+        strand1 = breakinfo.strand1
+        gene1 = breakinfo.gene1
+        junc1 = breakinfo.junc1
+        chr2 = breakinfo.chr2
+        bp2 = breakinfo.bp2
+        gene2 = breakinfo.gene2
+        junc2 = breakinfo.junc2
+        strand2 = breakinfo.strand2
+        mfline = breakinfo.linenr
         readname = readname[readname.index('_') + 1:]  # Remove the leading unique number
 
         w1 = f'{readname} fusionLineNr={mfline}\n'
@@ -179,8 +185,8 @@ class BlatFilter(Base):
             new_breakinfo = breakinfo
         else:  # Reverse
             b = breakinfo.copy()
-            b['chr2'], b['bp2'], b['strand2'], b['chr1'], b['bp1'], b['strand1'] = \
-            b['chr1'], b['bp1'], b['strand1'], b['chr2'], b['bp2'], b['strand2']
+            b.chr2, b.bp2, b.strand2, b.chr1, b.bp1, b.strand1 = \
+            b.chr1, b.bp1, b.strand1, b.chr2, b.bp2, b.strand2
             new_breakinfo = b
 
         return new_poses_filt, new_breakinfo
@@ -191,6 +197,11 @@ class BlatFilter(Base):
         poses_filt, breakinfo = self.__pos_sort(poses_filt, breakinfo)
         self.__write_to_file(fws, breakinfo, readname, seq, poses_filt, other_info)
         poses.clear()
+        return bool(poses_filt)
+
+    def __get_idx_by_linenr(self, readname):
+        '''readname=2-1_READNAME => index of breakinfo with linenr=2'''
+        return self.linenr2idx[int(readname[:readname.index('-')])]
 
     # [1] bp1 and bp2 are in the range of Tstart and Tend
     # [2] chr1 and chr2 are the same as Tname
@@ -198,107 +209,76 @@ class BlatFilter(Base):
     # [4] In the case of three or more items that satisfy [1] and [2]
     #     when the range of [Qstart2,Qend2] is wider than that of [Qstart1,Qend1], [Qstart2,Qend2] is given priority
     #     [Qstart1,Qend1] is not displayed
-    @Timer('filter')
-    def run(self):
-        # Get read names
-        cmd = '''\
-#!/bin/bash
-set -eu
-cd {work_dir}
-grep '^>' {inp_file} | sed -e 's/^>//'
-'''.format(work_dir=self.params.work_dir, inp_file=self.files['coll'])
-        readnames = self._run_cmd(cmd, 'grep')
-        readnames = readnames.split('\n')
-
-        # Check
-        cnts = [d.get('cnt') for d in self.breakinfo]
-        assert(len(readnames) == sum(cnts))
-
-        # Create a dictionary with readname in key and breakinfo index in value
-        i_rn = 0
-        rn2idx = dict()
-        for i, cnt in enumerate(cnts):
-            for _ in range(cnt):
-                rn2idx[readnames[i_rn]] = i
-                i_rn += 1
-
-        # Full path
-        blat_path = f'{self.params.work_dir}/{self.files["blat"]}'
-        coll_path = f'{self.params.work_dir}/{self.files["coll"]}'
-        filtmatch_path = f'{self.params.work_dir}/{self.files["filtmatch"]}'
-        filtmiss_path = f'{self.params.work_dir}/{self.files["filtmiss"]}'
-        filterr_path = f'{self.params.work_dir}/{self.files["filterr"]}'
-        filtwar_path = f'{self.params.work_dir}/{self.files["filtwar"]}'
-        fuseq_path = self.params.fuseq_path
-
+    def __filter(self, coll_path, blat_path, out_paths):
+        '''Return the numbers of psl rows, matched reads and missed reads'''
         # Open
         fr_collect = open(coll_path, 'r')
-        fr_blat = open(blat_path, 'r')
-        fw_filtmatch = open(filtmatch_path, 'w')
-        fw_filtmiss = open(filtmiss_path, 'w')
-        fw_filterr = open(filterr_path, 'w')
-        fw_filtwar = open(filtwar_path, 'w')
-        fw_filts = {'filtmatch': fw_filtmatch, 'filtmiss': fw_filtmiss,
-                    'filterr': fw_filterr, 'filtwar': fw_filtwar}
+        psl = Psl(blat_path)
+        fw_filts = {key: open(path, 'w') for key, path in out_paths.items()}
 
         # Filter and write
-        is_current = True
         start_extn = self.params.bp_start_extn
         end_extn = self.params.bp_end_extn
+        psl_rows = psl.rows([Psl.qname, Psl.strand, Psl.qstart, Psl.qend, Psl.tname, Psl.tstart, Psl.tend])
+        s = next(psl_rows, None)
+        n_rows = n_matches = n_misses = 0
         for row in fr_collect:
             # Target read
             cur_readname = row.rstrip('\n')[1:]
             cur_seq = fr_collect.readline().rstrip('\n')
-            cur_chr1, cur_chr2, cur_bp1, cur_bp2 = self.__update_chr_bp(rn2idx[cur_readname], self.breakinfo)
-            cur_breakinfo = self.breakinfo[rn2idx[cur_readname]]
+            cur_idx = self.__get_idx_by_linenr(cur_readname)
+            cur_chr1, cur_chr2, cur_bp1, cur_bp2 = self.__update_chr_bp(cur_idx, self.breakinfo)
+            cur_breakinfo = self.breakinfo[cur_idx]
 
             poses = []
             other_info = []
-            while True:
-                if is_current:
-                    s = fr_blat.readline().rstrip('\n').split('\t')
-                    if s == ['']:  # Check if file pointer is last
-                        break
-                    strand = s[8]           # strand
-                    readname = s[9]         # qname
-                    pos_start = int(s[11])  # qstart
-                    pos_end = int(s[12])    # qend
-                    chr = s[13]             # tname
-                    bp_start = int(s[15])   # tstart
-                    bp_end = int(s[16])     # tend
-                    pos_start_plus1 = pos_start + 1  # NOTE: pos_start+1(base1) matches blat result on web
-                    bp_start_plus1 = bp_start + 1    # NOTE: bp_start+1(base1) matches blat result on web
-                    bp_start_extn = bp_start_plus1 - start_extn
-                    bp_end_extn = bp_end + end_extn  # NOTE: end_extn=1 matches Genomon result
-                if readname == cur_readname:
-                    pos_intvl_ok = pos_end - pos_start == bp_end - bp_start if self.params.check_pos_intvl else True
-                    if pos_intvl_ok:
-                        # Filter based on chr and tstart-tend range
-                        if chr == cur_chr1 and bp_start_extn <= cur_bp1 <= bp_end_extn:
-                            poses.append((pos_start_plus1, pos_end, 1, bp_start_plus1, bp_end, chr, strand))
-                        elif chr == cur_chr2 and bp_start_extn <= cur_bp2 <= bp_end_extn:
-                            poses.append((pos_start_plus1, pos_end, 2, bp_start_plus1, bp_end, chr, strand))
-                    if chr == cur_chr1:
-                        other_info.append((bp_start_extn, bp_end_extn, 1, cur_bp1))
-                    elif chr == cur_chr2:
-                        other_info.append((bp_start_extn, bp_end_extn, 2, cur_bp2))
-                    is_current = True
-                else:
-                    # Write one read
-                    self.__filter_and_write(fw_filts, cur_breakinfo, cur_readname, cur_seq, poses, other_info)
-                    is_current = False
-                    break
-        if is_current:
-            # Write the remaining read
-            self.__filter_and_write(fw_filts, cur_breakinfo, cur_readname, cur_seq, poses, other_info)
+            # Rows of the target read
+            while s is not None and s[0] == cur_readname:  # s is None if all rows are read
+                _, strand, pos_start, pos_end, chr, bp_start, bp_end = s
+                pos_start_plus1 = pos_start + 1  # NOTE: pos_start+1(base1) matches blat result on web
+                bp_start_plus1 = bp_start + 1    # NOTE: bp_start+1(base1) matches blat result on web
+                bp_start_extn = bp_start_plus1 - start_extn
+                bp_end_extn = bp_end + end_extn  # NOTE: end_extn=1 matches Genomon result
+                pos_intvl_ok = pos_end - pos_start == bp_end - bp_start if self.params.check_pos_intvl else True
+                if pos_intvl_ok:
+                    # Filter based on chr and tstart-tend range
+                    if chr == cur_chr1 and bp_start_extn <= cur_bp1 <= bp_end_extn:
+                        poses.append((pos_start_plus1, pos_end, 1, bp_start_plus1, bp_end, chr, strand))
+                    elif chr == cur_chr2 and bp_start_extn <= cur_bp2 <= bp_end_extn:
+                        poses.append((pos_start_plus1, pos_end, 2, bp_start_plus1, bp_end, chr, strand))
+                if chr == cur_chr1:
+                    other_info.append((bp_start_extn, bp_end_extn, 1, cur_bp1))
+                elif chr == cur_chr2:
+                    other_info.append((bp_start_extn, bp_end_extn, 2, cur_bp2))
+                s = next(psl_rows, None)
+                n_rows += 1
+
+            # Write one read
+            if self.__filter_and_write(fw_filts, cur_breakinfo, cur_readname, cur_seq, poses, other_info):
+                n_matches += 1
+            else:
+                n_misses += 1
 
         # Close
         fr_collect.close()
-        fr_blat.close()
-        fw_filtmatch.close()
-        fw_filtmiss.close()
-        fw_filterr.close()
-        fw_filtwar.close()
+        psl.close()
+        for fw in fw_filts.values():
+            fw.close()
+
+        return {'psl_rows': n_rows, 'matches': n_matches, 'misses': n_misses}
+
+    def __add_metrics(self, counts):
+        for key, n in counts.items():
+            self.params.metrics.count(key, n)
+
+    def __get_out_paths(self, dir, suffix=''):
+        return {key: f'{dir}/{self.files[key]}{suffix}'
+                for key in ('filtmatch', 'filtmiss', 'filterr', 'filtwar')}
+
+    def __write_fuseq(self):
+        filtmatch_path = f'{self.params.work_dir}/{self.files["filtmatch"]}'
+        filtmiss_path = f'{self.params.work_dir}/{self.files["filtmiss"]}'
+        fuseq_path = self.params.fuseq_path
 
         # Concat filtmatch and filtmiss
         filtmatch_exists = os.path.exists(filtmatch_path)
@@ -315,3 +295,67 @@ cat {filtmatch} {filtmiss} > {fuseq}
             shutil.move(filtmatch_path, fuseq_path)
         elif filtmiss_exists:
             shutil.move(filtmiss_path, fuseq_path)
+
+    @Timer('filter')
+    def run(self):
+        # Filter and write
+        # Reads are streamed and no table of readnames is created, so memory does not grow with reads
+        blat_path = f'{self.params.work_dir}/{self.files["blat"]}'
+        coll_path = f'{self.params.work_dir}/{self.files["coll"]}'
+        out_paths = self.__get_out_paths(self.params.work_dir)
+        counts = self.__filter(coll_path, blat_path, out_paths)
+
+        # Check
+        assert(counts['matches'] + counts['misses'] == sum(d.cnt for d in self.breakinfo))
+
+        self.__add_metrics(counts)
+        self.__write_fuseq()
+
+    #
+    # Filter for each shard of blat
+    #
+
+    def __getstate__(self):
+        # Processes for shards only need parameters and breakinfo
+        state = self.__dict__.copy()
+        state.pop('_BlatFilter__executor', None)
+        state.pop('_BlatFilter__shards', None)
+        return state
+
+    def _filter_shard(self, i, coll_path, blat_path):
+        # Not name-mangled because methods sent to processes are looked up by name
+        out_paths = self.__get_out_paths(self.params.swork_dir, f'.{i}')
+        counts = self.__filter(coll_path, blat_path, out_paths)
+        return out_paths, counts
+
+    def start(self):
+        '''Start processes for filtering blat results of shards'''
+        # Shards are filtered on the host of fuseq even when blat runs on Shirokane
+        # Threads of other stages are running, so processes are not forked from fuseq
+        self.__executor = ProcessPoolExecutor(min(self.params.num_blat_parallels, self.params.budget.num_cpus),
+                                              mp_context=multiprocessing.get_context('forkserver'))
+        self.__shards = {}
+
+    def submit(self, i, coll_path, blat_path):
+        '''Filter blat results of a shard as soon as blat for the shard is finished'''
+        budget = self.params.budget
+        budget.acquire()
+        future = self.__executor.submit(self._filter_shard, i, coll_path, blat_path)
+        future.add_done_callback(lambda _: budget.release())
+        self.__shards[i] = future
+
+    @Timer('filter')
+    def join(self):
+        '''Wait for all shards and merge their filtered results in shard order'''
+        self.__executor.shutdown(wait=True)
+        results = [self.__shards[i].result() for i in sorted(self.__shards.keys())]
+        shard_paths = [out_paths for out_paths, _ in results]
+        for _, counts in results:
+            self.__add_metrics(counts)
+        for key, path in self.__get_out_paths(self.params.work_dir).items():
+            with open(path, 'wb') as fw:
+                for out_paths in shard_paths:
+                    with open(out_paths[key], 'rb') as fr:
+                        shutil.copyfileobj(fr, fw)
+                    os.remove(out_paths[key])
+        self.__write_fuseq()
@@ -0,0 +1,93 @@
+import json
+import mmap
+import struct
+import sys
+
+
+class BreakInfo:
+    '''Break information of a line in a fusion file with interned strings'''
+
+    __slots__ = ('linenr', 'sample',
+                 'chr1', 'bp1', 'strand1', 'gene1', 'junc1',
+                 'chr2', 'bp2', 'strand2', 'gene2', 'junc2', 'cnt')
+    str_fields = __slots__[1:12]
+
+    def __init__(self, linenr, sample, chr1, bp1, strand1, gene1, junc1,
+                 chr2, bp2, strand2, gene2, junc2, cnt=0):
+        intern = sys.intern
+        self.linenr = linenr
+        self.sample = intern(sample)
+        self.chr1 = intern(chr1)
+        self.bp1 = bp1
+        self.strand1 = intern(strand1)
+        self.gene1 = intern(gene1)
+        self.junc1 = intern(junc1)
+        self.chr2 = intern(chr2)
+        self.bp2 = bp2
+        self.strand2 = intern(strand2)
+        self.gene2 = intern(gene2)
+        self.junc2 = intern(junc2)
+        self.cnt = cnt
+
+    def __repr__(self):
+        return 'BreakInfo(' + ', '.join(f'{k}={getattr(self, k)!r}' for k in self.__slots__) + ')'
+
+    def copy(self):
+        return BreakInfo(*[getattr(self, k) for k in self.__slots__])
+
+
+class BreakInfoFile:
+    '''Columnar binary file of break information'''
+
+    magic = b'FUSEQBRK'
+    version = 1
+    header = struct.Struct('<8sIII')  # magic, version, number of lines, number of strings
+
+    @staticmethod
+    def save(path, breakinfo):
+        str2id = {}
+        for b in breakinfo:
+            for k in BreakInfo.str_fields:
+                str2id.setdefault(getattr(b, k), len(str2id))
+        blobs = [s.encode() for s in str2id]
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+
+        n = len(breakinfo)
+        with open(path, 'wb') as f:
+            f.write(BreakInfoFile.header.pack(BreakInfoFile.magic, BreakInfoFile.version, n, len(blobs)))
+            f.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+            f.write(b''.join(blobs))
+            for k in BreakInfo.str_fields:
+                f.write(struct.pack(f'<{n}I', *[str2id[getattr(b, k)] for b in breakinfo]))
+            f.write(struct.pack(f'<{n}I', *[b.linenr for b in breakinfo]))
+            f.write(struct.pack(f'<{n}I', *[b.cnt for b in breakinfo]))
+
+    @staticmethod
+    def __load_json(path):
+        with open(path, 'r') as f:
+            return [BreakInfo(**d) for d in json.load(f)]
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            if f.read(len(BreakInfoFile.magic)) != BreakInfoFile.magic:
+                return BreakInfoFile.__load_json(path)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            _, _, n, n_strs = BreakInfoFile.header.unpack_from(mm, 0)
+            pos = BreakInfoFile.header.size
+            offsets = struct.unpack_from(f'<{n_strs + 1}Q', mm, pos)
+            pos += 8 * (n_strs + 1)
+            strs = [sys.intern(mm[pos + s:pos + e].decode()) for s, e in zip(offsets, offsets[1:])]
+            pos += offsets[-1]
+            columns = []
+            for _ in BreakInfo.str_fields:
+                columns.append([strs[i] for i in struct.unpack_from(f'<{n}I', mm, pos)])
+                pos += 4 * n
+            linenrs = struct.unpack_from(f'<{n}I', mm, pos)
+            cnts = struct.unpack_from(f'<{n}I', mm, pos + 4 * n)
+        finally:
+            mm.close()
+        return [BreakInfo(linenr, *fields, cnt) for linenr, *fields, cnt in zip(linenrs, *columns, cnts)]
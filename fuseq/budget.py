@@ -0,0 +1,58 @@
+import os
+import threading
+from contextlib import contextmanager
+
+
+class Budget:
+    '''CPUs and memory shared by processes of all samples on the local host'''
+
+    def __init__(self, num_cpus=0, mem_gb=0):
+        self.num_cpus = num_cpus if num_cpus > 0 else (os.cpu_count() or 1)
+        self.mem = mem_gb * 1024 ** 3  # 0 means unlimited
+        self.__used_cpus = 0
+        self.__used_mem = 0
+        self.__cond = threading.Condition()
+
+    def __repr__(self):
+        mem = f'{self.mem // 1024 ** 3}G' if self.mem else 'unlimited'
+        return f'Budget(cpus={self.num_cpus}, mem={mem})'
+
+    def __getstate__(self):
+        # A condition cannot be sent to another process
+        state = self.__dict__.copy()
+        del state['_Budget__cond']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__cond = threading.Condition()
+
+    def __fit(self, cpus, mem):
+        # A request larger than the budget waits until nothing else is running
+        cpus = min(cpus, self.num_cpus)
+        mem = min(mem, self.mem) if self.mem else 0
+        return cpus, mem
+
+    def acquire(self, cpus=1, mem=0):
+        cpus, mem = self.__fit(cpus, mem)
+        with self.__cond:
+            while self.__used_cpus + cpus > self.num_cpus or \
+                    (self.mem and self.__used_mem + mem > self.mem):
+                self.__cond.wait()
+            self.__used_cpus += cpus
+            self.__used_mem += mem
+
+    def release(self, cpus=1, mem=0):
+        cpus, mem = self.__fit(cpus, mem)
+        with self.__cond:
+            self.__used_cpus -= cpus
+            self.__used_mem -= mem
+            self.__cond.notify_all()
+
+    @contextmanager
+    def use(self, cpus=1, mem=0):
+        self.acquire(cpus, mem)
+        try:
+            yield
+        finally:
+            self.release(cpus, mem)
@@ -20,6 +20,24 @@ class Checker:
             print(f'The number of elements in list {li} is {len(li)}, not 1')
             exit(1)
 
+    @staticmethod
+    def isoneof(val, li, name):
+        if val not in li:
+            print(f'{name} must be one of {", ".join(li)}, not {val}')
+            exit(1)
+
+    @staticmethod
+    def ispositive(val, name):
+        if val < 1:
+            print(f'{name} must be a positive integer, not {val}')
+            exit(1)
+
+    @staticmethod
+    def isexclusive(val1, val2, name1, name2):
+        if val1 and val2:
+            print(f'{name1} and {name2} options cannot be used at the same time')
+            exit(1)
+
     @staticmethod
     def onshirokane():
         ret = shutil.which('qsub')
@@ -27,6 +45,13 @@ class Checker:
             print('qsub is not installed')
             exit(1)
 
+    @staticmethod
+    def has_cmd(path, name):
+        ret = shutil.which(path) if path else None
+        if ret is None:
+            print(f'{name} is not installed')
+            exit(1)
+
     @staticmethod
     def has_blat(path):
         ret = shutil.which(path) if path else None
@@ -0,0 +1,52 @@
+import os
+import sqlite3
+from fuseq.base import Base
+from fuseq.digest import Digests
+
+
+class CollectionCache(Base):
+    '''Collected reads of fusion lines kept across runs for each sample and breakpoint pair'''
+
+    def __init__(self, path, jun_dic):
+        super().__init__()
+        self.path = path
+        self.con = sqlite3.connect(path)
+        self.con.execute('PRAGMA synchronous = OFF')
+        digests = Digests(self.con)
+        with self.con:
+            self.con.execute('CREATE TABLE IF NOT EXISTS samples (sample TEXT PRIMARY KEY, digest TEXT)')
+            self.con.execute('CREATE TABLE IF NOT EXISTS lines '
+                             '(sample TEXT, chr1 TEXT, bp1 TEXT, strand1 TEXT, chr2 TEXT, bp2 TEXT, strand2 TEXT, '
+                             'records TEXT, PRIMARY KEY (sample, chr1, bp1, strand1, chr2, bp2, strand2))')
+            for sample, jun_path in jun_dic.items():
+                sam_path = f'{os.path.splitext(jun_path)[0]}.sam'
+                self.__validate(sample, digests.get(jun_path) + digests.get(sam_path))
+
+    def __validate(self, sample, digest):
+        row = self.con.execute('SELECT digest FROM samples WHERE sample = ?', (sample,)).fetchone()
+        if row and row[0] == digest:
+            return
+        self.con.execute('DELETE FROM lines WHERE sample = ?', (sample,))
+        self.con.execute('INSERT OR REPLACE INTO samples VALUES (?, ?)', (sample, digest))
+
+    @staticmethod
+    def __key(d):
+        return (d.sample, d.chr1, d.bp1, d.strand1, d.chr2, d.bp2, d.strand2)
+
+    def get(self, d):
+        '''Return a list of (readname, seq) for a fusion line or None if it is not cached'''
+        row = self.con.execute('SELECT records FROM lines WHERE sample = ? AND chr1 = ? AND bp1 = ? '
+                               'AND strand1 = ? AND chr2 = ? AND bp2 = ? AND strand2 = ?',
+                               self.__key(d)).fetchone()
+        if row is None:
+            return None
+        return [tuple(r.split('\t')) for r in row[0].split('\n') if r]
+
+    def put(self, d, records):
+        records = ''.join(f'{readname}\t{seq}\n' for readname, seq in records)
+        self.con.execute('INSERT OR REPLACE INTO lines VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         self.__key(d) + (records,))
+
+    def close(self):
+        self.con.commit()
+        self.con.close()
@@ -1,16 +1,26 @@
 import csv
 import glob
-import multiprocessing
 import os
+import shlex
+from concurrent.futures import ThreadPoolExecutor
 from fuseq.timer import Timer
 from fuseq.base import Base
+from fuseq.breakinfo import BreakInfo
+from fuseq.command import Command
+from fuseq.coll_cache import CollectionCache
+from fuseq.junction import JunctionIndex
+from fuseq.sam import Sam
 
 
 class Collection(Base):
 
-    def __init__(self, params):
+    tasks_per_proc = 4  # Scripts per process on the local host for dynamic load balancing
+
+    def __init__(self, params, on_chunk=None):
         super().__init__()
         self.params = params
+        self.on_chunk = on_chunk  # Called with the index and path of each finished output chunk
+        self.command = Command(params.cmd_timeout)  # All scripts are cancelled when a script fails
         self.input_dir = f'{os.path.dirname(params.work_dir)}/input'
         self.mf_path = f'{self.input_dir}/fusion.txt'
         self.star_dir = f'{self.input_dir}/{os.path.basename(params.inputs["star_dir"])}'
@@ -57,12 +67,37 @@ class Collection(Base):
                     continue
                 [sample, chr1, bp1, strand1, chr2, bp2, strand2] = row_mf[0:7]
                 [gene1, junc1, gene2, junc2] = row_mf[8:12]
-                breakinfo.append({
-                    'linenr': linenr, 'sample': sample,
-                    'chr1': chr1, 'bp1': bp1, 'strand1': strand1, 'gene1': gene1, 'junc1': junc1,
-                    'chr2': chr2, 'bp2': bp2, 'strand2': strand2, 'gene2': gene2, 'junc2': junc2})
+                breakinfo.append(BreakInfo(linenr, sample,
+                                           chr1, bp1, strand1, gene1, junc1,
+                                           chr2, bp2, strand2, gene2, junc2))
         return breakinfo
 
+    def __get_jun_paths(self, breakinfo):
+        jun_dic = {}
+        for d in breakinfo:
+            sample = d.sample
+            if sample not in jun_dic:
+                jun_dic[sample] = glob.glob(f'{self.star_dir}/{sample}/*.junction')[0]
+        return jun_dic
+
+    def __get_bp_arng(self, d):
+        bp1_arng = str(int(d.bp1) + 1) if d.strand1 == '+' else str(int(d.bp1) - 1)
+        bp2_arng = str(int(d.bp2) + 1) if d.strand2 == '+' else str(int(d.bp2) - 1)
+        return bp1_arng, bp2_arng
+
+    def __create_jun_indexes(self, breakinfo, jun_dic):
+        """Read each junction file once and keep only breakpoints in breakinfo"""
+        keys = {sample: [] for sample in jun_dic.keys()}
+        for d in breakinfo:
+            bp1_arng, bp2_arng = self.__get_bp_arng(d)
+            keys[d.sample].append((d.chr1, bp1_arng, d.chr2, bp2_arng))
+        n_parallels = self.__get_scan_parallels()
+        return {sample: JunctionIndex(jun_dic[sample], keys[sample], n_parallels) for sample in jun_dic.keys()}
+
+    def __get_scan_parallels(self):
+        """Number of processes for scanning one file on the local host"""
+        return min(self.params.num_coll_parallels, os.cpu_count() or 1)
+
     def __create_script(self, breakinfo):
         # Commands for filtering
         readname_filt_cmd = \
@@ -85,10 +120,7 @@ out_path='{out_path}'
 
 touch "$out_path"
 cnt='0'
-for readname in $(cat "$jun_path" | awk '{{ \\
-  if ( ($1 == "'$chr1'" && $2 == "'$bp1'" && $4 == "'$chr2'" && $5 == "'$bp2'") || \\
-       ($1 == "'$chr2'" && $2 == "'$bp2'" && $4 == "'$chr1'" && $5 == "'$bp1'")    \\
-     ) print $10 }}'); do
+for readname in {readnames}; do
     {readname_filt_cmd}
     seqs=$(grep "^$readname" "$sam_path" | awk '{{ if ($7 != "=" && $9 == 0 && $15 != "XS:A:+") print $10 }}')
     [ -z "$seqs" ] && continue
@@ -100,24 +132,40 @@ for readname in $(cat "$jun_path" | awk '{{ \\
 done
 \n
 '''
+        # Readnames extracted from a junction file at runtime
+        readnames_cmd = '''\
+$(cat "$jun_path" | awk '{ \\
+  if ( ($1 == "'$chr1'" && $2 == "'$bp1'" && $4 == "'$chr2'" && $5 == "'$bp2'") || \\
+       ($1 == "'$chr2'" && $2 == "'$bp2'" && $4 == "'$chr1'" && $5 == "'$bp1'")    \\
+     ) print $10 }')'''
 
+        # Junction files
+        jun_dic = self.__get_jun_paths(breakinfo)
+        use_index = self.params.coll_engine == 'junction'
+        jun_indexes = self.__create_jun_indexes(breakinfo, jun_dic) if use_index else None
+
+        # Split lines into scripts
         line_cnt = len(breakinfo)
-        n_parallels = min(line_cnt, self.params.num_coll_parallels)
-        width = len(str(n_parallels))
-        # Determine the number of lines each process
-        lines_each_proc = line_cnt // n_parallels
-        n_plus1 = line_cnt - lines_each_proc * n_parallels
-        if n_plus1 == 0:
-            heads = [i * lines_each_proc for i in range(n_parallels + 1)]
+        if self.params.on_shirokane:
+            n_parallels = min(line_cnt, self.params.num_coll_parallels)
+            heads = self.__get_equal_heads(line_cnt, n_parallels)
+            costs = [1] * n_parallels
+        elif use_index:
+            # Cost of each line is estimated from the number of supporting reads
+            line_costs = []
+            for d in breakinfo:
+                bp1_arng, bp2_arng = self.__get_bp_arng(d)
+                readnames = jun_indexes[d.sample].readnames(d.chr1, bp1_arng, d.chr2, bp2_arng)
+                line_costs.append(1 + len(readnames))
+            heads = self.__get_cost_heads(line_costs, self.params.num_coll_parallels * self.tasks_per_proc)
+            costs = [sum(line_costs[head:tail]) for head, tail in zip(heads, heads[1:])]
         else:
-            plus1lines_each_proc = lines_each_proc + 1
-            total_plus1lines = plus1lines_each_proc * n_plus1
-            n_plus0 = n_parallels - n_plus1
-            heads = \
-                [i * plus1lines_each_proc for i in range(n_plus1)] + \
-                [total_plus1lines + i * lines_each_proc for i in range(n_plus0 + 1)]
+            # awk scans the whole junction file for each line, so lines are split equally
+            n_tasks = min(line_cnt, self.params.num_coll_parallels * self.tasks_per_proc)
+            heads = self.__get_equal_heads(line_cnt, n_tasks)
+            costs = [tail - head for head, tail in zip(heads, heads[1:])]
+        width = len(str(len(heads) - 1))
 
-        jun_dic = {}
         out_paths = []
         for i, (head, tail) in enumerate(zip(heads, heads[1:])):
             out_path = f'{self.params.swork_dir}/{self.out_file}{str(i+1).zfill(width)}'
@@ -126,31 +174,66 @@ done
             with open(script_path, 'w') as f:
                 f.write(cmd_head.format(out_path=out_path))
                 for d in breakinfo[head:tail]:
-                    [linenr, sample, chr1, bp1, strand1, _, _,
-                     chr2, bp2, strand2, _, _] = d.values()
-                    if sample not in jun_dic:
-                        jun_dic[sample] = glob.glob(f'{self.star_dir}/{sample}/*.junction')[0]
+                    linenr, sample, chr1, chr2 = d.linenr, d.sample, d.chr1, d.chr2
                     jun_path = jun_dic[sample]
-                    bp1_arng = str(int(bp1) + 1) if strand1 == '+' else str(int(bp1) - 1)
-                    bp2_arng = str(int(bp2) + 1) if strand2 == '+' else str(int(bp2) - 1)
+                    bp1_arng, bp2_arng = self.__get_bp_arng(d)
+                    if self.params.coll_engine == 'shell':
+                        readnames = readnames_cmd
+                    else:
+                        readnames = ' '.join(shlex.quote(r) for r in
+                                             jun_indexes[sample].readnames(chr1, bp1_arng, chr2, bp2_arng))
                     cmd = cmd_main.format(linenr=linenr, chr1=chr1, bp1=bp1_arng, chr2=chr2, bp2=bp2_arng,
-                                          jun_path=jun_path, out_path=out_path,
+                                          jun_path=jun_path, out_path=out_path, readnames=readnames,
                                           readname_filt_cmd=readname_filt_cmd, seq_filt_cmd=seq_filt_cmd)
                     f.write(cmd)
             os.chmod(script_path, 0o0755)
 
-        return out_paths
+        return out_paths, costs
+
+    def __get_equal_heads(self, line_cnt, n_parallels):
+        """Split lines into contiguous chunks with the same number of lines"""
+        lines_each_proc = line_cnt // n_parallels
+        n_plus1 = line_cnt - lines_each_proc * n_parallels
+        if n_plus1 == 0:
+            heads = [i * lines_each_proc for i in range(n_parallels + 1)]
+        else:
+            plus1lines_each_proc = lines_each_proc + 1
+            total_plus1lines = plus1lines_each_proc * n_plus1
+            n_plus0 = n_parallels - n_plus1
+            heads = \
+                [i * plus1lines_each_proc for i in range(n_plus1)] + \
+                [total_plus1lines + i * lines_each_proc for i in range(n_plus0 + 1)]
+        return heads
 
-    def __task(self, i_proc, out_path, errs, rcs):
-        cmd = f'bash {out_path}.sh'
-        _, err, rc = self._run_cmd(cmd, 'collection', ignore_err=True)
-        errs[i_proc] = err
-        rcs[i_proc] = rc
+    def __get_cost_heads(self, line_costs, n_tasks):
+        """Split lines into about n_tasks contiguous chunks with nearly equal costs
+           A line with a cost above the average of chunks becomes a chunk by itself"""
+        total = sum(line_costs)
+        heads = [0]
+        acc = 0
+        for i, cost in enumerate(line_costs):
+            is_large = cost * n_tasks >= total
+            if is_large and i > heads[-1]:
+                heads.append(i)  # A large line starts a chunk
+            acc += cost
+            if (is_large or acc * n_tasks >= total * len(heads)) and i + 1 < len(line_costs):
+                heads.append(i + 1)
+        heads.append(len(line_costs))
+        return heads
+
+    def __run_script(self, i, out_path):
+        with self.params.budget.use():
+            ret = self._run_cmd(f'bash {out_path}.sh', 'collection', ignore_err=True, command=self.command)
+        if ret[2] != 0:
+            self.command.cancel()
+        elif self.on_chunk:
+            self.on_chunk(i, out_path)
+        return ret
 
     def __collect(self, breakinfo):
         """Collect data for Blat input"""
         # Create scripts
-        out_paths = self.__create_script(breakinfo)
+        out_paths, costs = self.__create_script(breakinfo)
         n_parallels = len(out_paths)
 
         # Run scripts
@@ -171,31 +254,68 @@ bash {coll_path}${{id}}.sh
             self._run_cmd_on_uge(cmd, script_path, n_parallels, 'collection_uge')
 
         else:
-            manager = multiprocessing.Manager()
-            errs = manager.dict()
-            rcs = manager.dict()
-            jobs = []
-            for i in range(n_parallels):
-                p = multiprocessing.Process(
-                    target=self.__task,
-                    args=(i, out_paths[i], errs, rcs))
-                jobs.append(p)
-                p.start()
-            for job in jobs:
-                job.join()
+            # Idle workers take the next script, starting with the most costly one
+            n_workers = min(n_parallels, self.params.num_coll_parallels)
+            order = sorted(range(n_parallels), key=lambda i: costs[i], reverse=True)
+            with ThreadPoolExecutor(n_workers) as executor:
+                futures = {i: executor.submit(self.__run_script, i, out_paths[i]) for i in order}
 
             # Check return codes
             has_err = False
             for i in range(n_parallels):
-                if rcs[i] != 0:
+                _, err, rc = futures[i].result()
+                if rc != 0:
                     print('[Error] Return code is not 0 at collection script')
-                    print(f'err: {errs[i]}, rc: {rcs[i]}')
+                    print(f'err: {err}, rc: {rc}')
                     has_err = True
             if has_err:
                 exit(1)
 
         return out_paths
 
+    def __collect_native(self, breakinfo):
+        """Collect data for Blat input without shell scripts
+           Each junction file and each sam file are read only once"""
+        readname_filt = self.params.readname_filt
+        seq_filt = self.params.seq_filt
+
+        # Readnames for each fusion line
+        jun_dic = self.__get_jun_paths(breakinfo)
+        jun_indexes = self.__create_jun_indexes(breakinfo, jun_dic)
+        line_readnames = []
+        sample_readnames = {sample: set() for sample in jun_dic.keys()}
+        for d in breakinfo:
+            bp1_arng, bp2_arng = self.__get_bp_arng(d)
+            readnames = jun_indexes[d.sample].readnames(d.chr1, bp1_arng, d.chr2, bp2_arng)
+            if readname_filt:
+                readnames = [rn for rn in readnames if rn == readname_filt]
+            line_readnames.append(readnames)
+            sample_readnames[d.sample].update(readnames)
+
+        # Sequences for each readname
+        sample_seqs = {}
+        for sample, readnames in sample_readnames.items():
+            sam_path = f'{os.path.splitext(jun_dic[sample])[0]}.sam'
+            index_path = f'{self.input_dir}/sam_index/{sample}.idx' if self.params.sam_index else None
+            sample_seqs[sample] = Sam(sam_path, index_path, self.__get_scan_parallels()).sequences(readnames)
+
+        # Write
+        coll_path = f'{self.params.work_dir}/{self.out_file}'
+        with open(coll_path, 'w') as f:
+            for d, readnames in zip(breakinfo, line_readnames):
+                seqs = sample_seqs[d.sample]
+                linenr = d.linenr
+                cnt = 0
+                for readname in readnames:
+                    for seq in seqs[readname]:
+                        if seq_filt and seq != seq_filt:
+                            continue
+                        cnt += 1
+                        f.write(f'>{linenr}-{cnt}_{readname}\n{seq}\n')
+                d.cnt = cnt
+        if self.on_chunk:
+            self.on_chunk(0, coll_path)
+
     def __add_count_to(self, breakinfo):
         coll_path = f'{self.params.work_dir}/{self.out_file}'
         cnts = [0] * len(breakinfo)
@@ -214,7 +334,7 @@ bash {coll_path}${{id}}.sh
                 next(reader)  # sequence data
             cnts[tgt_linenr - 2] = prev_cnt
         for i, cnt in enumerate(cnts):
-            breakinfo[i]['cnt'] = cnt
+            breakinfo[i].cnt = cnt
 
     def __concat(self, inp_paths):
         inp_files = ' '.join([os.path.basename(path) for path in inp_paths])
@@ -226,11 +346,58 @@ cat {inp_files} > ../{out_file}
 '''.format(swork_dir=self.params.swork_dir, inp_files=inp_files, out_file=self.out_file)
         self._run_cmd(cmd, 'cat_coll_files')
 
+    def __collect_with_engine(self, breakinfo):
+        if self.params.coll_engine == 'native':
+            with self.params.budget.use(self.__get_scan_parallels()):
+                self.__collect_native(breakinfo)
+        else:
+            coll_out_paths = self.__collect(breakinfo)
+            self.__concat(coll_out_paths)
+
+    def __read_collect(self):
+        '''Return lists of (readname, seq) in the collect file for each line number'''
+        coll_path = f'{self.params.work_dir}/{self.out_file}'
+        line_records = {}
+        with open(coll_path, 'r') as f:
+            for name in f:
+                seq = f.readline().rstrip('\n')
+                linenr = int(name[1:name.index('-')])  # >2-1_READNAME => 2
+                line_records.setdefault(linenr, []).append((name.rstrip('\n')[name.index('_') + 1:], seq))
+        return line_records
+
+    def __collect_with_cache(self, breakinfo):
+        """Collect data only for fusion lines missing in the cache"""
+        cache = CollectionCache(f'{self.input_dir}/{self.files["coll_cache"]}', self.__get_jun_paths(breakinfo))
+        line_records = [cache.get(d) for d in breakinfo]
+        missing = [d for d, records in zip(breakinfo, line_records) if records is None]
+        if missing:
+            self.__collect_with_engine(missing)
+            new_records = self.__read_collect()
+            for d in missing:
+                cache.put(d, new_records.get(d.linenr, []))
+            line_records = [records if records is not None else new_records.get(d.linenr, [])
+                            for d, records in zip(breakinfo, line_records)]
+        cache.close()
+
+        # Write
+        coll_path = f'{self.params.work_dir}/{self.out_file}'
+        with open(coll_path, 'w') as f:
+            for d, records in zip(breakinfo, line_records):
+                for cnt, (readname, seq) in enumerate(records, start=1):
+                    f.write(f'>{d.linenr}-{cnt}_{readname}\n{seq}\n')
+                d.cnt = len(records)
+
     @Timer('collection')
     def run(self):
         self.__create_symlinks()
         breakinfo = self.__get_breakinfo()
-        coll_out_paths = self.__collect(breakinfo)
-        self.__concat(coll_out_paths)
-        self.__add_count_to(breakinfo)
+        # Cached data are not filtered with readname or sequence
+        if self.params.coll_cache and not self.params.readname_filt and not self.params.seq_filt:
+            self.__collect_with_cache(breakinfo)
+        else:
+            self.__collect_with_engine(breakinfo)
+            if self.params.coll_engine != 'native':
+                self.__add_count_to(breakinfo)
+        self.params.metrics.count('fusion_lines', len(breakinfo))
+        self.params.metrics.count('reads', sum(d.cnt for d in breakinfo))
         return breakinfo
@@ -0,0 +1,120 @@
+import asyncio
+import os
+import signal
+import threading
+
+
+class Command:
+    '''Shell commands run with asyncio, each in its own process group'''
+
+    limit = 1 << 24      # Maximum bytes of a line of stdout and stderr
+    interrupted = False  # No command starts after interruption
+    __lock = threading.Lock()
+    __running = {}       # Process group of each running command to its Command
+
+    def __init__(self, timeout=0):
+        self.timeout = timeout  # Seconds for each command (0: no limit)
+        self.cancelled = False
+
+    #
+    # Process groups
+    #
+
+    @staticmethod
+    def __kill(pgid):
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def cancel(self):
+        '''Kill the running commands and do not start later ones'''
+        with Command.__lock:
+            self.cancelled = True
+            pgids = [pgid for pgid, cmd in Command.__running.items() if cmd is self]
+        for pgid in pgids:
+            self.__kill(pgid)
+
+    @classmethod
+    def interrupt(cls, signum=None, frame=None):
+        '''Kill all running commands and do not start later ones'''
+        # Called as a signal handler, so the lock, which may be held by the interrupted code, is not taken
+        # Commands registered after the copy of __running see interrupted and kill themselves
+        cls.interrupted = True
+        for pgid in list(cls.__running):
+            cls.__kill(pgid)
+        if signum is not None:
+            raise KeyboardInterrupt
+
+    #
+    # Run
+    #
+
+    async def __read(self, stream, on_line=None):
+        lines = []
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                raise asyncio.LimitOverrunError(f'Line of output longer than {self.limit} bytes', self.limit)
+            if not line:
+                break
+            line = line.decode()
+            if on_line:
+                on_line(line)
+            else:
+                lines.append(line)
+        return ''.join(lines).rstrip('\n')
+
+    async def __run(self, cmd, on_line):
+        if self.cancelled or Command.interrupted:
+            return '', 'Cancelled', -signal.SIGKILL
+        p = await asyncio.create_subprocess_shell(cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                  start_new_session=True, limit=self.limit)
+        with Command.__lock:
+            Command.__running[p.pid] = self
+            if self.cancelled or Command.interrupted:
+                self.__kill(p.pid)  # Cancelled while starting
+        try:
+            out, err = await asyncio.wait_for(
+                asyncio.gather(self.__read(p.stdout, on_line), self.__read(p.stderr)), self.timeout or None)
+            await p.wait()
+        except asyncio.TimeoutError:
+            self.__kill(p.pid)
+            await p.wait()
+            return '', f'Timeout after {self.timeout} seconds', p.returncode
+        except asyncio.LimitOverrunError as e:
+            self.__kill(p.pid)
+            await p.wait()
+            return '', str(e), p.returncode or 1
+        except BaseException:
+            # Cancelled by a failed command of run_all
+            self.__kill(p.pid)
+            await p.wait()
+            raise
+        finally:
+            with Command.__lock:
+                del Command.__running[p.pid]
+        if (self.cancelled or Command.interrupted) and p.returncode != 0:
+            err = f'{err}\nCancelled'.lstrip('\n')
+        return out, err, p.returncode
+
+    def run(self, cmd, on_line=None):
+        '''Return stdout, stderr and the return code of a command, with stdout passed to on_line if given'''
+        return asyncio.run(self.__run(cmd, on_line))
+
+    async def __run_all(self, cmds, num_parallels):
+        sem = asyncio.Semaphore(num_parallels)
+
+        async def run(cmd):
+            async with sem:
+                ret = await self.__run(cmd, None)
+            if ret[2] != 0:
+                self.cancel()  # The other commands are useless
+            return ret
+
+        return await asyncio.gather(*[run(cmd) for cmd in cmds])
+
+    def run_all(self, cmds, num_parallels):
+        '''Run commands with up to num_parallels at the same time and return their results in order'''
+        return asyncio.run(self.__run_all(cmds, num_parallels))
@@ -0,0 +1,67 @@
+import os
+from fuseq.base import Base
+
+
+class Dedup(Base):
+    '''Align each unique sequence of the collect file only once'''
+
+    def __init__(self, params, cache=None, files=None):
+        super().__init__(files)
+        self.params = params
+        self.coll_path = f'{params.work_dir}/{self.files["coll"]}'
+        self.uniq_path = f'{params.work_dir}/{self.files["coll_uniq"]}'
+        self.blat_uniq_path = f'{params.work_dir}/{self.files["blat_uniq"]}'
+        self.blat_path = f'{params.work_dir}/{self.files["blat"]}'
+        self.cache = cache
+        self.__seq2uid = {}
+        self.__cached = {}  # uid: psl rows in the cache
+
+    def compress(self):
+        '''Return the number of sequences written for blat'''
+        seq2uid = self.__seq2uid
+        n_seqs = 0
+        with open(self.coll_path, 'r') as fr:
+            with open(self.uniq_path, 'w') as fw:
+                for readname in fr:
+                    seq = fr.readline()
+                    if seq in seq2uid:
+                        continue
+                    uid = f'u{len(seq2uid) + 1}'
+                    seq2uid[seq] = uid
+                    rows = self.cache.get(seq.rstrip('\n')) if self.cache else None
+                    if rows is not None:
+                        self.__cached[uid] = rows
+                        continue
+                    fw.write(f'>{uid}\n{seq}')
+                    n_seqs += 1
+        return n_seqs
+
+    def expand(self):
+        # Psl rows of each unique sequence
+        uid2rows = {}
+        with open(self.blat_uniq_path, 'r') as f:
+            for row in f:
+                sp = row.split('\t', 10)
+                uid = sp[9]
+                if uid in uid2rows:
+                    uid2rows[uid].append(sp)
+                else:
+                    uid2rows[uid] = [sp]
+
+        # Rows of new sequences are added to the cache
+        seq2uid = self.__seq2uid
+        if self.cache:
+            self.cache.update({seq.rstrip('\n'): uid2rows.get(uid, []) for seq, uid in seq2uid.items()
+                               if uid not in self.__cached})
+            uid2rows.update(self.__cached)
+
+        # Replace synthetic names with readnames
+        tmp_path = f'{self.blat_path}.tmp'
+        with open(self.coll_path, 'r') as fr:
+            with open(tmp_path, 'w') as fw:
+                for readname in fr:
+                    readname = readname.rstrip('\n')[1:]
+                    seq = fr.readline()
+                    for sp in uid2rows.get(seq2uid[seq], []):
+                        fw.write('\t'.join(sp[:9] + [readname] + sp[10:]))
+        os.replace(tmp_path, self.blat_path)
@@ -0,0 +1,24 @@
+import os
+from fuseq.base import Base
+
+
+class Digests(Base):
+    '''Content hashes of files computed again only when their size or mtime changes'''
+
+    def __init__(self, con):
+        super().__init__()
+        self.con = con
+        self.con.execute('CREATE TABLE IF NOT EXISTS files '
+                         '(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT)')
+
+    def get(self, path):
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        row = self.con.execute('SELECT size, mtime_ns, digest FROM files WHERE path = ?', (path,)).fetchone()
+        if row and row[:2] == (st.st_size, st.st_mtime_ns):
+            return row[2]
+        digest = self._hash_file(path)
+        with self.con:
+            self.con.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                             (path, st.st_size, st.st_mtime_ns, digest))
+        return digest
@@ -0,0 +1,83 @@
+import os
+import subprocess
+import threading
+import time
+from fuseq.base import Base
+
+
+class GfServer(Base):
+    '''gfServer holding the reference in memory on the local host, left running for later samples and runs'''
+
+    lock = threading.Lock()  # Samples computed at the same time start only one server
+    interval = 5             # Seconds between status checks while the server loads the reference
+
+    def __init__(self, params):
+        super().__init__()
+        self.params = params
+        self.host = params.gfserver_host
+        self.port = params.gfserver_port
+        self.server_dir = f'{params.fuseq_root_dir}/.gfserver'
+
+    def __get_twobit(self):
+        '''gfServer requires a reference in 2bit format'''
+        reference = self.params.reference
+        if self.params.ref_twobit:
+            return self.params.ref_twobit
+        if reference.endswith('.2bit'):
+            return reference
+        path = f'{os.path.splitext(reference)[0]}.2bit'
+        if os.path.isfile(path):
+            return path
+        # Convert the reference
+        path = f'{self.server_dir}/{os.path.basename(os.path.splitext(reference)[0])}.2bit'
+        if os.path.isfile(path) and os.path.getmtime(path) >= os.path.getmtime(reference):
+            return path
+        fatotwobit = self.params.fatotwobit_path
+        if fatotwobit is None:
+            print('[Error] faToTwoBit is not installed')
+            exit(1)
+        os.makedirs(self.server_dir, exist_ok=True)
+        self._run_cmd(f'{fatotwobit} {reference} {path}.tmp && mv {path}.tmp {path}', 'faToTwoBit')
+        return path
+
+    def is_running(self):
+        cmd = f'{self.params.gfserver_path} status {self.host} {self.port}'
+        _, _, ret = self._run_cmd(cmd, 'gfServer_status', ignore_err=True)
+        return ret == 0
+
+    def __get_files(self):
+        '''Names of the 2bit files served by the running server'''
+        cmd = f'{self.params.gfserver_path} files {self.host} {self.port}'
+        out, _, ret = self._run_cmd(cmd, 'gfServer_files', ignore_err=True)
+        return [os.path.basename(line) for line in out.splitlines()] if ret == 0 else []
+
+    def start(self):
+        '''Return the path to the reference held by the server'''
+        with self.lock:
+            twobit = self.__get_twobit()
+            if self.is_running():
+                # A server started by another run may hold another reference
+                files = self.__get_files()
+                if files != [os.path.basename(twobit)]:
+                    print(f'[Error] gfServer on {self.host}:{self.port} serves {", ".join(files) or "unknown files"}'
+                          f' instead of {os.path.basename(twobit)}')
+                    print(f'Stop it with "gfServer stop {self.host} {self.port}" or use another --gfserver-port')
+                    exit(1)
+                return twobit
+
+            os.makedirs(self.server_dir, exist_ok=True)
+            log_path = f'{self.server_dir}/gfServer_{self.port}.log'
+            cmd = [self.params.gfserver_path, 'start', self.host, str(self.port),
+                   '-canStop', f'-log={log_path}', os.path.basename(twobit)]
+            if self.params.ooc:
+                cmd.insert(-1, f'-ooc={self.params.ooc}')
+            p = subprocess.Popen(cmd, cwd=os.path.dirname(twobit), stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.DEVNULL, start_new_session=True)
+
+            # Wait until the reference is loaded
+            while not self.is_running():
+                if p.poll() is not None:
+                    print(f'[Error] gfServer exited with code {p.returncode}. See {log_path}')
+                    exit(1)
+                time.sleep(self.interval)
+        return twobit
@@ -0,0 +1,50 @@
+from fuseq.scanner import Scanner
+
+
+def _index_range(rows, wanted):
+    index = {}
+    for _, row in rows:
+        # Fields are separated in the same way as awk
+        sp = row.decode().split(None, 10)
+        if len(sp) < 10:
+            continue
+        key = JunctionIndex.key(sp[0], sp[1], sp[3], sp[4])
+        if wanted is not None and key not in wanted:
+            continue
+        if key in index:
+            index[key].append(sp[9])
+        else:
+            index[key] = [sp[9]]
+    return index
+
+
+class JunctionIndex:
+    '''Readnames in a STAR junction file indexed by breakpoint pair in either orientation'''
+
+    def __init__(self, path, keys=None, num_parallels=1):
+        self.path = path
+        self.num_parallels = num_parallels
+        self.__index = {}
+        self.__create(keys)
+
+    @staticmethod
+    def key(chr1, bp1, chr2, bp2):
+        '''Return the same key for (chr1, bp1, chr2, bp2) and (chr2, bp2, chr1, bp1)'''
+        if (chr1, bp1) <= (chr2, bp2):
+            return (chr1, bp1, chr2, bp2)
+        return (chr2, bp2, chr1, bp1)
+
+    def __create(self, keys):
+        '''Store only the given keys if keys are specified'''
+        wanted = {self.key(*k) for k in keys} if keys is not None else None
+        index = self.__index
+        # Merge partial indexes in file order
+        for part in Scanner(self.path, self.num_parallels).run(_index_range, wanted):
+            for key, readnames in part.items():
+                if key in index:
+                    index[key].extend(readnames)
+                else:
+                    index[key] = readnames
+
+    def readnames(self, chr1, bp1, chr2, bp2):
+        return self.__index.get(self.key(chr1, bp1, chr2, bp2), [])
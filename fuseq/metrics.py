@@ -0,0 +1,71 @@
+import json
+import os
+import resource
+import threading
+import time
+
+
+class Metrics:
+    '''Performance metrics of the stages and commands of a sample written to a JSON file'''
+
+    file = 'metrics.json'
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self.counts = {}
+        self.cmds = []
+        self.__lock = threading.Lock()
+
+    def __repr__(self):
+        return f'Metrics(name={self.name})'
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_Metrics__lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def snapshot():
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        child = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return {'wall': time.time(),
+                'cpu': own.ru_utime + own.ru_stime + child.ru_utime + child.ru_stime,
+                'peak_rss': max(own.ru_maxrss, child.ru_maxrss) * 1024,  # KB on Linux
+                'read_bytes': (own.ru_inblock + child.ru_inblock) * 512,
+                'write_bytes': (own.ru_oublock + child.ru_oublock) * 512}
+
+    def add_stage(self, name, start):
+        '''Add the difference from a snapshot at the start of a stage'''
+        end = self.snapshot()
+        with self.__lock:
+            stage = self.stages.setdefault(name, {'wall': 0, 'cpu': 0, 'peak_rss': 0,
+                                                  'read_bytes': 0, 'write_bytes': 0})
+            for key in ('wall', 'cpu', 'read_bytes', 'write_bytes'):
+                stage[key] += end[key] - start[key]
+            stage['peak_rss'] = max(stage['peak_rss'], end['peak_rss'])
+        return end['wall'] - start['wall']
+
+    def add_cmd(self, name, wall, returncode):
+        with self.__lock:
+            self.cmds.append({'name': name, 'wall': wall, 'returncode': returncode})
+
+    def count(self, key, n):
+        with self.__lock:
+            self.counts[key] = self.counts.get(key, 0) + n
+
+    def save(self, work_dir):
+        '''Write to the working directory, or next to it if it is deleted'''
+        out_dir = work_dir if os.path.isdir(work_dir) else os.path.dirname(work_dir)
+        path = base_path = f'{out_dir}/{self.file}'
+        num = 1
+        while os.path.exists(path):
+            path = f'{base_path}.{num}'
+            num += 1
+        with open(path, 'w') as f:
+            json.dump({'name': self.name, 'stages': self.stages,
+                       'counts': self.counts, 'commands': self.cmds}, f, indent=2)
@@ -4,6 +4,7 @@ import os
 import re
 import shutil
 from fuseq import __version__
+from fuseq.budget import Budget
 from fuseq.checker import Checker
 
 
@@ -23,6 +24,11 @@ class BoolConv(argparse.Action):
 
 
 class Option:
+    # shell   : Scan a junction file with awk for each fusion line
+    # junction: Index a junction file once for all fusion lines
+    # native  : Index a junction file once and read a sam file once in Python
+    coll_engines = ['shell', 'junction', 'native']
+
     def __init__(self):
         self.__parse()
         self.__create()
@@ -44,12 +50,32 @@ class Option:
         #
         parser.add_argument('--blat-path', default='', type=str, help='Path to blat command')
         parser.add_argument('--collection-processes', default=4, type=int, help='Number of parallel processes for collection computation')
+        parser.add_argument('--collection-engine', default='shell', type=str, choices=self.coll_engines, help='Method for collecting readnames and sequences')
+        parser.add_argument('--collection-cache', default=False, action=BoolConv, nargs='?', help='Reuse collected data of fusion lines computed in previous runs')
+        parser.add_argument('--sam-index', default=False, action=BoolConv, nargs='?', help='Use a persistent readname index of sam files in native collection engine')
+        parser.add_argument('--blat-processes', default=1, type=int, help='Number of parallel processes for blat computation')
         parser.add_argument('--no-use-filt', default=False, action=BoolConv, nargs='?', help='Use merge_fusionfusion.txt instead of merge_fusionfusion_filt.txt')
         parser.add_argument('--readname', default='', type=str, help='Filtering with readname')
         parser.add_argument('--sequence', default='', type=str, help='Filtering with sequence')
         parser.add_argument('--start', default=0, type=int, help='Extend the start position of breakpoints at Blat filtering')
         parser.add_argument('--end', default=0, type=int, help='Extend the end position of breakpoints at Blat filtering')
+        parser.add_argument('--stream', default=False, action=BoolConv, nargs='?', help='Run blat for each chunk of collection as soon as the chunk is finished')
+        parser.add_argument('--deduplicate', default=False, action=BoolConv, nargs='?', help='Align identical sequences only once with blat')
+        parser.add_argument('--blat-cache', default='', type=str, help='Directory for psl rows of sequences reused across runs and samples')
+        parser.add_argument('--blat-cache-size', default=10, type=int, help='Maximum size in GB of the blat cache')
+        parser.add_argument('--shard-filter', default=False, action=BoolConv, nargs='?', help='Filter blat results of each shard as soon as blat for the shard is finished')
+        parser.add_argument('--reference-window', default=0, type=int, help='Align reads only against windows of this size around breakpoints (0: whole reference)')
+        parser.add_argument('--sample-processes', default=1, type=int, help='Number of samples computed at the same time')
+        parser.add_argument('--batch-samples', default=False, action=BoolConv, nargs='?', help='Run blat only once for all samples')
+        parser.add_argument('--max-processes', default=0, type=int, help='Maximum number of processes for collection and blat shared by all samples (0: number of CPUs)')
+        parser.add_argument('--max-memory', default=0, type=int, help='Maximum memory in GB for blat processes shared by all samples (0: unlimited)')
+        parser.add_argument('--command-timeout', default=0, type=int, help='Kill a command on the local host running longer than this number of seconds (0: no limit)')
         parser.add_argument('--reference', default='/share/pub/genomon/.genomon_local/genomon_pipeline-2.6.3/database/GRCh37/GRCh37.fa', type=str, help='Reference path')
+        parser.add_argument('--reference-cache', default='', type=str, help='Directory for the reference in 2bit format and the ooc file prepared once for blat')
+        # Options for gfServer
+        parser.add_argument('--gfserver', default=False, action=BoolConv, nargs='?', help='Align reads with gfClient through gfServer holding the reference in memory')
+        parser.add_argument('--gfserver-host', default='localhost', type=str, help='Host name of gfServer')
+        parser.add_argument('--gfserver-port', default=17779, type=int, help='Port number of gfServer')
         # Options on Shirokane
         parser.add_argument('--shirokane', default=False, action=BoolConv, nargs='?', help='Compute on Shirokane')
         parser.add_argument('--collection-tasks', default=100, type=int, help='Number of array job tasks for collection computation')
@@ -132,12 +158,33 @@ class Option:
         # restart_filter
         args.blat_path = shutil.which(args.blat_path if args.blat_path else 'blat')
         # collection_processes
+        args.coll_engine = args.collection_engine
+        args.coll_cache = args.collection_cache
+        # sam_index
+        # blat_processes
         args.use_filt = False if args.no_use_filt else True
         args.readname_filt = args.readname
         args.seq_filt = args.sequence
         args.bp_start_extn = args.start
         args.bp_end_extn = args.end
+        # stream
+        args.blat_cache = os.path.abspath(args.blat_cache) if args.blat_cache else ''
+        # blat_cache_size
+        args.dedup = args.deduplicate or bool(args.blat_cache)  # Blat cache works on unique sequences
+        # shard_filter
+        args.ref_window = args.reference_window
+        args.num_sample_parallels = args.sample_processes
+        # batch_samples
+        args.budget = Budget(args.max_processes, args.max_memory)
+        args.cmd_timeout = args.command_timeout
         args.reference = os.path.abspath(args.reference)
+        args.ref_cache = os.path.abspath(args.reference_cache) if args.reference_cache else ''
+        args.fatotwobit_path = shutil.which('faToTwoBit')
+        # gfserver
+        # gfserver_host
+        # gfserver_port
+        args.gfserver_path = shutil.which('gfServer')
+        args.gfclient_path = shutil.which('gfClient')
         args.on_shirokane = args.shirokane
         args.num_coll_parallels = num_coll_parallels
         args.num_blat_parallels = num_blat_parallels
@@ -148,12 +195,14 @@ class Option:
         # Delete
         del args.fuseq_root_directory, args.genomon_root_directory, \
         args.blat_options, args.star_directory, args.lines, args.no_delete_work, \
-        args.collection_processes, args.no_use_filt, args.readname, args.sequence, \
-        args.start, args.end, args.shirokane, args.collection_tasks, args.blat_tasks, \
+        args.collection_processes, args.collection_engine, args.collection_cache, args.blat_processes, args.no_use_filt, args.readname, args.sequence, \
+        args.start, args.end, args.deduplicate, args.reference_window, args.sample_processes, args.max_processes, args.max_memory, args.command_timeout, args.reference_cache, args.shirokane, args.collection_tasks, args.blat_tasks, \
         args.no_check_position_interval, args.print_filtering_error, args.time \
 
         # Add
         args.is_restart = True if args.restart_blat or args.restart_filter else False
+        args.ref_twobit = None  # Set with RefCache
+        args.ooc = None         # Set with RefCache
         args.fuseq_filename = 'fusion_sequence.txt'
         args.work_dirname = 'work_restart'
         args.swork_dirname = 'splits'
@@ -162,7 +211,7 @@ class Option:
         if args.shirokane:
             return args.collection_tasks, args.blat_tasks
         else:
-            return args.collection_processes, 1
+            return args.collection_processes, args.blat_processes
 
     def __modify_blat_opts(self, blat_opts):
         if not blat_opts:
@@ -197,6 +246,30 @@ class Option:
         Checker.isdir(args.genomon_root_dir)
         Checker.isfile(args.reference)
         Checker.has_blat(args.blat_path)
+        Checker.isoneof(args.coll_engine, self.coll_engines, 'collection_engine')
+        Checker.ispositive(args.num_sample_parallels, 'sample_processes')
+        Checker.ispositive(args.num_blat_parallels, 'blat_processes')
+        if args.blat_cache:
+            Checker.ispositive(args.blat_cache_size, 'blat_cache_size')
+            Checker.isexclusive(args.blat_cache, args.stream, 'blat_cache', 'stream')
+            Checker.isexclusive(args.blat_cache, args.shard_filter, 'blat_cache', 'shard_filter')
+        if args.stream:
+            Checker.isexclusive(args.stream, args.on_shirokane, 'stream', 'shirokane')
+            Checker.isexclusive(args.stream, args.dedup, 'stream', 'deduplicate')
+            Checker.isexclusive(args.stream, args.coll_cache, 'stream', 'collection_cache')
+            Checker.isexclusive(args.stream, args.ref_window, 'stream', 'reference_window')
+        if args.gfserver:
+            Checker.has_cmd(args.gfserver_path, 'gfServer')
+            Checker.has_cmd(args.gfclient_path, 'gfClient')
+            Checker.isexclusive(args.gfserver, args.on_shirokane, 'gfserver', 'shirokane')
+            Checker.isexclusive(args.gfserver, args.ref_window, 'gfserver', 'reference_window')
+        if args.batch_samples:
+            Checker.isexclusive(args.batch_samples, args.stream, 'batch_samples', 'stream')
+            Checker.isexclusive(args.batch_samples, args.shard_filter, 'batch_samples', 'shard_filter')
+        if args.shard_filter:
+            Checker.isexclusive(args.shard_filter, args.dedup, 'shard_filter', 'deduplicate')
+        if args.ref_cache and not args.reference.endswith('.2bit'):
+            Checker.has_cmd(args.fatotwobit_path, 'faToTwoBit')
         if args.on_shirokane:
             Checker.onshirokane()
 
@@ -1,11 +1,14 @@
-import json
 import os
 import shutil
 from fuseq.checker import Checker
 from fuseq.base import Base
+from fuseq.alignment import Alignment
 from fuseq.collection import Collection
-from fuseq.blat import Blat, PBlat
+from fuseq.blat import SBlat
 from fuseq.blat_filter import BlatFilter
+from fuseq.breakinfo import BreakInfoFile
+from fuseq.gfserver import GfServer
+from fuseq.store import Store
 
 class Pipeline(Base):
 
@@ -36,14 +39,11 @@ class Pipeline(Base):
                 f.write(f'{key}{space}: {val}\n')
 
     def __save_breakinfo(self, breakinfo):
-        with open(self.breakinfo_path, 'w') as f:
-            json.dump(breakinfo, f)
+        BreakInfoFile.save(self.breakinfo_path, breakinfo)
 
     def __load_breakinfo(self):
         Checker.isfile(self.breakinfo_path)
-        with open(self.breakinfo_path) as f:
-            breakinfo = json.load(f)
-        return breakinfo
+        return BreakInfoFile.load(self.breakinfo_path)
 
     def __delete_work_dir(self, make_empty_dir=False):
         shutil.rmtree(self.params.work_dir, ignore_errors=True)
@@ -55,74 +55,42 @@ class Pipeline(Base):
     # Restart
     #
 
-    def __on_blat_restart(self, breakinfo):
-        coll_inp = f"{self.params.work_dir}/{self.files['coll']}"
+    def __on_blat_restart(self, breakinfo, store):
         coll_out = f"{self.params.work_dir}/{self.files['coll_res']}"
 
-        # Conditions for obtaining targets
+        # Get targets with indexed lookups
         if self.params.readname_filt:
-            target = self.params.readname_filt + '\n'
-
-            def cond():
-                return readname[readname.index('_') + 1:] == target
+            reads = store.reads(readname=self.params.readname_filt)
         else:
-            target = self.params.seq_filt + '\n'
-
-            def cond():
-                return seq == target
-
-        # Filter collection data
-        linenrs = []
-        cnts = {}
-        with open(coll_out, 'w') as fw:
-            with open(coll_inp, 'r') as fr:
-                while True:
-                    readname = fr.readline()
-                    if not readname:
-                        break
-                    seq = fr.readline()
-                    if cond():
-                        linenr = int(readname[1:readname.index('_')].split('-')[0])  # >2-1_READNAME => 2
-                        linenrs.append(linenr)
-                        cnts[linenr] = cnts[linenr] + 1 if linenr in cnts else 1
-                        fw.write(readname)
-                        fw.write(seq)
+            reads = store.reads(seq=self.params.seq_filt)
 
         # Check
-        if not linenrs:
+        if not reads:
             print('[Error] No input data after filtering')
             exit(1)
 
+        # Write collection data
+        cnts = {}
+        with open(coll_out, 'w') as fw:
+            for _, linenr, name, seq in reads:
+                cnts[linenr] = cnts[linenr] + 1 if linenr in cnts else 1
+                fw.write(f'>{name}\n{seq}\n')
+
         # Filter breakinfo
-        linenrs = set(linenrs)
-        breakinfo = [b for b in breakinfo if int(b['linenr']) in linenrs]
+        breakinfo = [b for b in breakinfo if b.linenr in cnts]
         for b in breakinfo:
-            b['cnt'] = cnts[b['linenr']]
+            b.cnt = cnts[b.linenr]
 
-        return breakinfo
+        return breakinfo, reads
 
-    def __on_blat_filter_restart(self, breakinfo):
-        breakinfo = self.__on_blat_restart(breakinfo)
+    def __on_blat_filter_restart(self, breakinfo, store):
+        breakinfo, reads = self.__on_blat_restart(breakinfo, store)
 
-        # Get readnames
-        coll_inp = f"{self.params.work_dir}/{self.files['coll_res']}"
-        readnames = []
-        with open(coll_inp, 'r') as f:
-            while True:
-                readname = f.readline().rstrip('\n')
-                if not readname:
-                    break
-                readnames.append(readname[1:])
-                f.readline()
-
-        # Filter blat data
-        blat_inp = f"{self.params.work_dir}/{self.files['blat']}"
+        # Write blat data of the targets
         blat_out = f"{self.params.work_dir}/{self.files['blat_res']}"
-        with open(blat_inp, 'r') as fr:
-            with open(blat_out, 'w') as fw:
-                for blat in fr:
-                    if blat.split('\t')[9] in readnames:
-                        fw.write(blat)
+        with open(blat_out, 'w') as fw:
+            for row in store.psl_rows([read[0] for read in reads]):
+                fw.write(row)
 
         return breakinfo
 
@@ -130,10 +98,13 @@ class Pipeline(Base):
         if not self.params.readname_filt and not self.params.seq_filt:
             return breakinfo
 
+        store = Store(self.params)
+        store.update(with_blat=not self.params.restart_blat)
         if self.params.restart_blat:
-            breakinfo = self.__on_blat_restart(breakinfo)
+            breakinfo, _ = self.__on_blat_restart(breakinfo, store)
         else:
-            breakinfo = self.__on_blat_filter_restart(breakinfo)
+            breakinfo = self.__on_blat_filter_restart(breakinfo, store)
+        store.close()
 
         # Change file names
         self.files['coll'] = self.files['coll_res']
@@ -141,11 +112,37 @@ class Pipeline(Base):
 
         return breakinfo
 
+    #
+    # Blat for all samples at once
+    #
+
+    def collect(self):
+        '''Run collection and leave blat to Batch'''
+        self.__delete_work_dir(make_empty_dir=True)
+        self.__save_params()
+        breakinfo = Collection(self.params).run()
+        self.__save_breakinfo(breakinfo)
+        return breakinfo
+
+    def filter(self, breakinfo):
+        '''Run filtering after blat by Batch'''
+        BlatFilter(self.params, breakinfo).run()
+        if self.params.delete_work:
+            self.__delete_work_dir()
+
+    def save_metrics(self):
+        self.params.metrics.save(self.params.work_dir)
+
     #
     # Start
     #
 
     def run(self, restart=False):
+        self.__run()
+        self.save_metrics()
+
+    def __run(self):
+        streaming = self.params.stream and not self.params.is_restart and not self.params.stop_blat
         if self.params.is_restart:
             # Preprocess
             Checker.isdir(self.params.work_dir)
@@ -158,24 +155,43 @@ class Pipeline(Base):
             self.__delete_work_dir(make_empty_dir=True)
             self.__save_params()
             # Collection
-            breakinfo = Collection(self.params).run()
+            if streaming:
+                # Blat runs for each output chunk of collection as soon as the chunk is finished
+                reference = GfServer(self.params).start() if self.params.gfserver else None
+                sblat = SBlat(self.params, reference)
+                breakinfo = Collection(self.params, sblat.submit).run()
+            else:
+                breakinfo = Collection(self.params).run()
             self.__save_breakinfo(breakinfo)
 
         if self.params.stop_blat:
             return
 
+        # Input and output of blat, which are changed by restarts with --readname or --sequence
+        io_files = {'coll': self.files['coll'], 'blat': self.files['blat']}
+
+        # Blat results of each shard are filtered as soon as blat for the shard is finished
+        sharded = streaming or self.params.on_shirokane or self.params.num_blat_parallels > 1
+        shard_filter = self.params.shard_filter and sharded and not self.params.is_restart \
+            and not self.params.stop_filter
+        if shard_filter:
+            blat_filter = BlatFilter(self.params, breakinfo)
+            blat_filter.start()
+
         # Blat
-        if not self.params.restart_filter:
-            if self.params.on_shirokane:
-                PBlat(self.params).run()
-            else:
-                Blat(self.params).run()
+        if streaming:
+            sblat.run(blat_filter.submit if shard_filter else None)
+        elif not self.params.restart_filter:
+            Alignment(self.params, breakinfo, io_files, blat_filter.submit if shard_filter else None).run()
 
         if self.params.stop_filter:
             return
 
         # Filter
-        BlatFilter(self.params, breakinfo).run()
+        if shard_filter:
+            blat_filter.join()
+        else:
+            BlatFilter(self.params, breakinfo, io_files).run()
 
         # Postprocess
         if self.params.delete_work:
@@ -0,0 +1,59 @@
+import mmap
+import os
+
+
+class Psl:
+    '''Psl file read with mmap converting only the requested columns'''
+
+    # Column indexes
+    strand = 8
+    qname = 9
+    qstart = 11
+    qend = 12
+    tname = 13
+    tstart = 15
+    tend = 16
+    int_cols = frozenset([0, 1, 2, 3, 4, 5, 6, 7, 10, 11, 12, 14, 15, 16, 17])
+
+    block_size = 1 << 20  # Bytes decoded at a time
+
+    def __init__(self, path):
+        self.path = path
+        self.__f = open(path, 'rb')
+        self.__mm = mmap.mmap(self.__f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.__mm:
+            self.__mm.close()
+        self.__f.close()
+
+    def __blocks(self):
+        '''Yield rows without newline in blocks ending at a newline'''
+        mm = self.__mm
+        size = len(mm)
+        pos = 0
+        while pos < size:
+            end = mm.find(b'\n', min(pos + self.block_size, size) - 1)
+            end = size if end == -1 else end + 1
+            rows = mm[pos:end].decode().split('\n')
+            if not rows[-1]:
+                rows.pop()
+            yield rows
+            pos = end
+
+    def rows(self, cols, with_row=False):
+        '''Yield a tuple of the given columns for each row, followed by the row itself if with_row is True'''
+        maxsplit = max(cols) + 1
+        for rows in self.__blocks():
+            sps = [row.split('\t', maxsplit) for row in rows]
+            columns = [list(map(int, [sp[i] for sp in sps])) if i in self.int_cols else [sp[i] for sp in sps]
+                       for i in cols]
+            if with_row:
+                columns.append([row + '\n' for row in rows])
+            yield from zip(*columns)
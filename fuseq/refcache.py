@@ -0,0 +1,61 @@
+import os
+import re
+import sqlite3
+from fuseq.base import Base
+from fuseq.digest import Digests
+
+
+class RefCache(Base):
+    '''2bit reference and ooc file prepared once for blat and shared by later runs'''
+
+    rep_match = 1024        # Tiles occurring more than this number of times are overused
+    digests_file = 'digests.db'
+
+    def __init__(self, params):
+        super().__init__()
+        self.params = params
+        self.reference = params.reference
+        self.cache_dir = params.ref_cache
+        self.tile_size = self.__get_tile_size(params.blat_opts)
+
+    @staticmethod
+    def __get_tile_size(blat_opts):
+        m = re.search(r'-tileSize=(\d+)', blat_opts)
+        return int(m.group(1)) if m else 11
+
+    def __get_digest(self):
+        '''Return the content hash of the reference'''
+        con = sqlite3.connect(f'{self.cache_dir}/{self.digests_file}')
+        digest = Digests(con).get(self.reference)
+        con.close()
+        return digest
+
+    def __create_twobit(self, path):
+        if self.params.fatotwobit_path is None:
+            print('[Error] faToTwoBit is not installed')
+            exit(1)
+        cmd = f'{self.params.fatotwobit_path} {self.reference} {path}.tmp && mv {path}.tmp {path}'
+        self._run_cmd(cmd, 'faToTwoBit')
+
+    def __create_ooc(self, twobit, path):
+        cmd = f'{self.params.blat_path} {twobit} /dev/null /dev/null -tileSize={self.tile_size} ' \
+              f'-makeOoc={path}.tmp -repMatch={self.rep_match} && mv {path}.tmp {path}'
+        self._run_cmd(cmd, 'makeOoc')
+
+    def prepare(self):
+        '''Return paths to the reference in 2bit format and the ooc file'''
+        os.makedirs(self.cache_dir, exist_ok=True)
+        ref_dir = f'{self.cache_dir}/{self.__get_digest()}'
+        os.makedirs(ref_dir, exist_ok=True)
+
+        if self.reference.endswith('.2bit'):
+            twobit = self.reference
+        else:
+            twobit = f'{ref_dir}/{os.path.basename(os.path.splitext(self.reference)[0])}.2bit'
+            if not os.path.isfile(twobit):
+                self.__create_twobit(twobit)
+
+        ooc = f'{ref_dir}/{self.tile_size}.ooc'
+        if not os.path.isfile(ooc):
+            self.__create_ooc(twobit, ooc)
+        return twobit, ooc
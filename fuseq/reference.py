@@ -0,0 +1,126 @@
+import os
+from fuseq.base import Base
+
+
+class Reference:
+    '''Random access to sequences in a FASTA file with its .fai index, created in memory if missing'''
+
+    def __init__(self, path):
+        self.path = path
+        self.__index = {}  # name: (length, offset, line bases, line width)
+        fai_path = f'{path}.fai'
+        if os.path.isfile(fai_path) and os.path.getmtime(fai_path) >= os.path.getmtime(path):
+            self.__load_fai(fai_path)
+        else:
+            self.__create_index()
+
+    def __load_fai(self, fai_path):
+        with open(fai_path, 'r') as f:
+            for row in f:
+                sp = row.rstrip('\n').split('\t')
+                self.__index[sp[0]] = tuple(int(s) for s in sp[1:5])
+
+    def __create_index(self):
+        name = None
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for row in f:
+                if row.startswith(b'>'):
+                    name = row[1:].split()[0].decode()
+                    length = 0
+                    seq_offset = offset + len(row)
+                    line_bases = line_width = 0
+                elif name is not None:
+                    bases = len(row.rstrip(b'\r\n'))
+                    if line_bases == 0:
+                        line_bases, line_width = bases, len(row)
+                    length += bases
+                    self.__index[name] = (length, seq_offset, line_bases, line_width)
+                offset += len(row)
+
+    def has(self, name):
+        return name in self.__index
+
+    def length(self, name):
+        return self.__index[name][0]
+
+    def fetch(self, name, start, end):
+        '''Return the sequence in [start, end) with 0-based positions'''
+        length, offset, line_bases, line_width = self.__index[name]
+        start = max(0, start)
+        end = min(length, end)
+        if start >= end:
+            return ''
+        pos_start = offset + start // line_bases * line_width + start % line_bases
+        pos_end = offset + (end - 1) // line_bases * line_width + (end - 1) % line_bases + 1
+        with open(self.path, 'rb') as f:
+            f.seek(pos_start)
+            buf = f.read(pos_end - pos_start)
+        return buf.replace(b'\n', b'').replace(b'\r', b'').decode()
+
+
+class MiniReference(Base):
+    '''Small reference consisting of windows around breakpoints'''
+
+    line_bases = 60
+
+    def __init__(self, params, breakinfo):
+        super().__init__()
+        self.params = params
+        self.breakinfo = breakinfo
+        self.path = f'{params.work_dir}/{self.files["miniref"]}'
+        self.__windows = {}  # window name: (chr, start, chr length)
+
+    def __get_intervals(self, reference):
+        w = self.params.ref_window
+        intervals = {}
+        for d in self.breakinfo:
+            for chr, bp in ((d.chr1, int(d.bp1)), (d.chr2, int(d.bp2))):
+                if not reference.has(chr):
+                    continue
+                start = max(0, bp - 1 - w)
+                end = min(reference.length(chr), bp + w)
+                intervals.setdefault(chr, []).append((start, end))
+        # Merge overlapping intervals
+        merged = {}
+        for chr, ivs in intervals.items():
+            ivs.sort()
+            cur = [list(ivs[0])]
+            for start, end in ivs[1:]:
+                if start <= cur[-1][1]:
+                    cur[-1][1] = max(cur[-1][1], end)
+                else:
+                    cur.append([start, end])
+            merged[chr] = cur
+        return merged
+
+    def create(self):
+        reference = Reference(self.params.reference)
+        intervals = self.__get_intervals(reference)
+        with open(self.path, 'w') as f:
+            for chr, ivs in intervals.items():
+                chr_len = reference.length(chr)
+                for start, end in ivs:
+                    name = f'{chr}:{start + 1}-{end}'
+                    self.__windows[name] = (chr, start, chr_len)
+                    seq = reference.fetch(chr, start, end)
+                    f.write(f'>{name}\n')
+                    for i in range(0, len(seq), self.line_bases):
+                        f.write(seq[i:i + self.line_bases] + '\n')
+        return self.path
+
+    def lift(self, psl_path):
+        '''Convert target names and positions in a psl file to those of the reference'''
+        tmp_path = f'{psl_path}.lift'
+        with open(psl_path, 'r') as fr:
+            with open(tmp_path, 'w') as fw:
+                for row in fr:
+                    sp = row.rstrip('\n').split('\t')
+                    chr, offset, chr_len = self.__windows[sp[13]]
+                    sp[13] = chr
+                    sp[14] = str(chr_len)
+                    sp[15] = str(int(sp[15]) + offset)
+                    sp[16] = str(int(sp[16]) + offset)
+                    sp[20] = ''.join(f'{int(t) + offset},' for t in sp[20].split(',') if t)
+                    fw.write('\t'.join(sp) + '\n')
+        os.replace(tmp_path, psl_path)
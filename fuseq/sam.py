@@ -0,0 +1,189 @@
+import mmap
+import os
+import struct
+from array import array
+from fuseq.scanner import Scanner
+
+
+def _sequences_range(rows, readnames, lens):
+    seqs = {}
+    for _, row in rows:
+        sp = None
+        for le in lens:
+            rn = row[:le]
+            if rn not in readnames:
+                continue
+            if sp is None:
+                sp = row.decode().split()
+                if not Sam.is_target(sp):
+                    break
+            if rn in seqs:
+                seqs[rn].append(sp[9])
+            else:
+                seqs[rn] = [sp[9]]
+    return seqs
+
+
+def _index_range(rows):
+    names = []
+    offsets = array('Q')
+    for offset, row in rows:
+        if Sam.is_target(row.decode().split()):
+            names.append(row[:row.find(b'\t')])
+            offsets.append(offset)
+    return names, offsets
+
+
+class Sam:
+    '''Sequences of chimeric reads in a STAR sam file selected as the shell engine does'''
+
+    def __init__(self, path, index_path=None, num_parallels=1):
+        self.path = path
+        self.index_path = index_path
+        self.num_parallels = num_parallels
+
+    @staticmethod
+    def is_target(sp):
+        '''sp is a row split in the same way as awk'''
+        if len(sp) < 10:
+            return False
+        try:
+            tlen_is_zero = float(sp[8]) == 0
+        except ValueError:
+            tlen_is_zero = sp[8] == '0'
+        return sp[6] != '=' and tlen_is_zero and (len(sp) < 15 or sp[14] != 'XS:A:+')
+
+    def sequences(self, readnames):
+        '''Return a dictionary with readname in key and sequences in value'''
+        if self.index_path:
+            return self.__sequences_by_index(readnames)
+        return self.__sequences_by_scan(readnames)
+
+    def __sequences_by_scan(self, readnames):
+        '''The file is read only once for all readnames'''
+        seqs = {rn: [] for rn in readnames}
+        readnames_b = {rn.encode() for rn in seqs.keys()}
+        lens = sorted({len(rn) for rn in readnames_b})
+        if not lens:
+            return seqs
+        # Merge partial results in file order
+        for part in Scanner(self.path, self.num_parallels).run(_sequences_range, readnames_b, lens):
+            for rn, part_seqs in part.items():
+                seqs[rn.decode()].extend(part_seqs)
+        return seqs
+
+    def __sequences_by_index(self, readnames):
+        '''Only the rows of the readnames are read using the index'''
+        seqs = {rn: [] for rn in readnames}
+        if not seqs:
+            return seqs
+        index = SamIndex(self.path, self.index_path, self.num_parallels)
+        index.load()
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self.path) else b''
+            for rn in seqs.keys():
+                for offset in index.offsets(rn.encode()):
+                    end = mm.find(b'\n', offset)
+                    row = mm[offset:end if end != -1 else len(mm)].decode()
+                    seqs[rn].append(row.split()[9])
+            if mm:
+                mm.close()
+        index.close()
+        return seqs
+
+
+class SamIndex:
+    '''Sidecar index of a sam file from readname to byte offset'''
+
+    magic = b'FUSEQSAM'
+    version = 1
+    header = struct.Struct('<8sQQQQ')  # magic, version, sam size, sam mtime_ns, number of rows
+
+    def __init__(self, sam_path, path, num_parallels=1):
+        self.sam_path = sam_path
+        self.path = path
+        self.num_parallels = num_parallels
+        self.__fr = None
+        self.__mm = None
+
+    def __stat(self):
+        st = os.stat(self.sam_path)
+        return st.st_size, st.st_mtime_ns
+
+    def is_valid(self):
+        if not os.path.isfile(self.path):
+            return False
+        with open(self.path, 'rb') as f:
+            buf = f.read(self.header.size)
+        if len(buf) != self.header.size:
+            return False
+        magic, version, size, mtime_ns, _ = self.header.unpack(buf)
+        return magic == self.magic and version == self.version and (size, mtime_ns) == self.__stat()
+
+    def create(self):
+        size, mtime_ns = self.__stat()
+        names = []
+        offsets = array('Q')
+        for part_names, part_offsets in Scanner(self.sam_path, self.num_parallels).run(_index_range):
+            names.extend(part_names)
+            offsets.extend(part_offsets)
+
+        # Sort by readname and then by offset
+        order = sorted(range(len(names)), key=lambda i: (names[i], offsets[i]))
+        starts = array('Q', [0])
+        for i in order:
+            starts.append(starts[-1] + len(names[i]))
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.tmp{os.getpid()}'
+        with open(tmp_path, 'wb') as f:
+            f.write(self.header.pack(self.magic, self.version, size, mtime_ns, len(names)))
+            f.write(starts.tobytes())
+            f.write(array('Q', [offsets[i] for i in order]).tobytes())
+            for i in order:
+                f.write(names[i])
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        '''Create the index file if necessary and map it into memory'''
+        if not self.is_valid():
+            self.create()
+        self.__fr = open(self.path, 'rb')
+        self.__mm = mmap.mmap(self.__fr.fileno(), 0, access=mmap.ACCESS_READ)
+        n = self.header.unpack_from(self.__mm)[4]
+        pos = self.header.size
+        mv = memoryview(self.__mm)
+        self.__mv = mv
+        self.__n = n
+        self.__starts = mv[pos:pos + 8 * (n + 1)].cast('Q')
+        pos += 8 * (n + 1)
+        self.__offsets = mv[pos:pos + 8 * n].cast('Q')
+        pos += 8 * n
+        self.__names_pos = pos
+
+    def close(self):
+        self.__starts.release()
+        self.__offsets.release()
+        self.__mv.release()
+        self.__mm.close()
+        self.__fr.close()
+
+    def __name(self, i):
+        pos = self.__names_pos
+        return self.__mm[pos + self.__starts[i]:pos + self.__starts[i + 1]]
+
+    def offsets(self, prefix):
+        '''Return byte offsets of rows starting with prefix in file order'''
+        lo, hi = 0, self.__n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.__name(mid) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        offsets = []
+        for i in range(lo, self.__n):
+            if not self.__name(i).startswith(prefix):
+                break
+            offsets.append(self.__offsets[i])
+        return sorted(offsets)
@@ -0,0 +1,75 @@
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+def _scan(path, start, end, func, args):
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return func(Scanner.lines(mm, start, end), *args)
+        finally:
+            mm.close()
+
+
+class Scanner:
+    '''Scan a file in parallel with newline-aligned byte ranges'''
+
+    block_size = 1 << 26  # Bytes copied from mmap at a time
+
+    def __init__(self, path, num_parallels=1):
+        self.path = path
+        self.num_parallels = max(1, num_parallels)
+
+    @staticmethod
+    def lines(mm, start, end, block_size=None):
+        '''Yield byte offset and row without newline for each row in [start, end)'''
+        block_size = block_size if block_size else Scanner.block_size
+        pos = start
+        while pos < end:
+            blk_end = min(end, pos + block_size)
+            if blk_end < end:
+                nl = mm.rfind(b'\n', pos, blk_end)
+                if nl == -1:
+                    nl = mm.find(b'\n', blk_end, end)
+                    blk_end = end if nl == -1 else nl + 1
+                else:
+                    blk_end = nl + 1
+            rows = mm[pos:blk_end].split(b'\n')
+            if not rows[-1]:
+                rows.pop()
+            for row in rows:
+                yield pos, row
+                pos += len(row) + 1
+            pos = blk_end
+
+    def ranges(self):
+        size = os.path.getsize(self.path)
+        if size == 0:
+            return []
+        bounds = [0]
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            for i in range(1, self.num_parallels):
+                pos = max(size * i // self.num_parallels, bounds[-1])
+                nl = mm.find(b'\n', pos)
+                pos = size if nl == -1 else nl + 1
+                if pos >= size:
+                    break
+                if pos > bounds[-1]:
+                    bounds.append(pos)
+            mm.close()
+        bounds.append(size)
+        return list(zip(bounds, bounds[1:]))
+
+    def run(self, func, *args):
+        '''Return a list of partial results in the order of byte ranges'''
+        # func must be defined at module level to be sent to processes
+        ranges = self.ranges()
+        if len(ranges) < 2:
+            return [_scan(self.path, start, end, func, args) for start, end in ranges]
+        # Threads of other samples are running, so processes are not forked from fuseq
+        with ProcessPoolExecutor(len(ranges), mp_context=multiprocessing.get_context('forkserver')) as executor:
+            futures = [executor.submit(_scan, self.path, start, end, func, args) for start, end in ranges]
+            return [future.result() for future in futures]
@@ -0,0 +1,90 @@
+import os
+import sqlite3
+from fuseq.base import Base
+from fuseq.psl import Psl
+
+
+class Store(Base):
+    '''Collect records and psl rows in the working directory indexed for restarts'''
+
+    def __init__(self, params):
+        super().__init__()
+        self.params = params
+        self.path = f'{params.work_dir}/{self.files["store"]}'
+        self.coll_path = f'{params.work_dir}/{self.files["coll"]}'
+        self.blat_path = f'{params.work_dir}/{self.files["blat"]}'
+        self.con = sqlite3.connect(self.path)
+        self.con.execute('PRAGMA synchronous = OFF')
+        self.con.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    @staticmethod
+    def __stamp(path):
+        st = os.stat(path)
+        return f'{st.st_size}:{st.st_mtime_ns}'
+
+    def __is_valid(self, key, path):
+        row = self.con.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row is not None and row[0] == self.__stamp(path)
+
+    def __set_stamp(self, key, path):
+        self.con.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, self.__stamp(path)))
+
+    def __create_reads(self):
+        def records():
+            with open(self.coll_path, 'r') as f:
+                for i, name in enumerate(f):
+                    name = name.rstrip('\n')[1:]    # >2-1_READNAME => 2-1_READNAME
+                    seq = f.readline().rstrip('\n')
+                    linenr = int(name[:name.index('-')])
+                    yield i, linenr, name, name[name.index('_') + 1:], seq
+
+        con = self.con
+        con.execute('DROP TABLE IF EXISTS reads')
+        con.execute('CREATE TABLE reads (id INTEGER PRIMARY KEY, linenr INTEGER, name TEXT, readname TEXT, seq TEXT)')
+        con.executemany('INSERT INTO reads VALUES (?, ?, ?, ?, ?)', records())
+        con.execute('CREATE INDEX reads_readname ON reads (readname)')
+        con.execute('CREATE INDEX reads_seq ON reads (seq)')
+        con.execute('CREATE INDEX reads_linenr ON reads (linenr)')
+        self.__set_stamp('coll', self.coll_path)
+
+    def __create_psl(self):
+        name2id = dict((name, i) for i, name in self.con.execute('SELECT id, name FROM reads'))
+
+        def rows():
+            with Psl(self.blat_path) as psl:
+                for i, (qname, row) in enumerate(psl.rows([Psl.qname], with_row=True)):
+                    yield i, name2id.get(qname), row
+
+        con = self.con
+        con.execute('DROP TABLE IF EXISTS psl')
+        con.execute('CREATE TABLE psl (id INTEGER PRIMARY KEY, read_id INTEGER, row TEXT)')
+        con.executemany('INSERT INTO psl VALUES (?, ?, ?)', rows())
+        con.execute('CREATE INDEX psl_read_id ON psl (read_id)')
+        self.__set_stamp('blat', self.blat_path)
+
+    def update(self, with_blat=True):
+        '''Create tables whose source files are changed'''
+        with self.con:
+            coll_changed = not self.__is_valid('coll', self.coll_path)
+            if coll_changed:
+                self.__create_reads()
+            if with_blat and (coll_changed or not self.__is_valid('blat', self.blat_path)):
+                self.__create_psl()
+
+    def reads(self, readname=None, seq=None, linenr=None):
+        '''Return (id, linenr, name, seq) of reads matching all of the given keys'''
+        conds = [(col, val) for col, val in (('readname', readname), ('seq', seq), ('linenr', linenr))
+                 if val is not None]
+        where = ' AND '.join(f'{col} = ?' for col, _ in conds)
+        sql = f'SELECT id, linenr, name, seq FROM reads WHERE {where} ORDER BY id'
+        return self.con.execute(sql, [val for _, val in conds]).fetchall()
+
+    def psl_rows(self, read_ids):
+        '''Return psl rows of the given reads'''
+        rows = []
+        for read_id in read_ids:
+            rows += self.con.execute('SELECT id, row FROM psl WHERE read_id = ?', (read_id,)).fetchall()
+        return [row for _, row in sorted(rows)]
+
+    def close(self):
+        self.con.close()
@@ -1,7 +1,8 @@
 import time
+from fuseq.metrics import Metrics
 
 class Timer:
-    '''Measure the processing time of a method function'''
+    '''Measure the processing time and other metrics of a method function'''
 
     def __init__(self, name):
         self.name = name
@@ -9,9 +10,15 @@ class Timer:
     def __call__(self, func):
 
         def wrap(cls, *args, **kwargs):
-            start = time.time()
-            ret = func(cls, *args, **kwargs)
-            et = time.time() - start
+            metrics = getattr(getattr(cls, 'params', None), 'metrics', None)
+            if metrics:
+                start = Metrics.snapshot()
+                ret = func(cls, *args, **kwargs)
+                et = metrics.add_stage(self.name, start)
+            else:
+                start = time.time()
+                ret = func(cls, *args, **kwargs)
+                et = time.time() - start
             try:
                 # Class dependent
                 if cls.params.print_time:
@@ -14,5 +14,5 @@ setup(
     description='Breakpoint information for fusion gene sequences obtained by Genomon',
     packages=['fuseq'],
     scripts=[f'{scripts_dir}/fuseq'],
-    python_requires='>=3.6',
+    python_requires='>=3.8',
 )